@@ -2,15 +2,29 @@
 
 import yaml
 import aiomqtt
+import functools
+import json
+import logging
 import os
 import platform
+from collections.abc import Mapping
 from datetime import datetime, timezone
+from types import MappingProxyType
+from typing import ClassVar
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
 from raspy2mqtt.constants import MqttDefaults, HomeAssistantDefaults, SeqMicroHatConstants, MiscAppDefaults
 
-from schema import Schema, Optional, SchemaError, Regex
+from schema import Schema, Optional, SchemaError, Regex, And, Or
 from importlib.metadata import version
 from importlib.metadata import PackageNotFoundError
 
+try:
+    # use the LibYAML-based loader, which is much faster than the pure-Python one, when available
+    from yaml import CSafeLoader as YamlSafeLoader
+except ImportError:
+    from yaml import SafeLoader as YamlSafeLoader
+
 #
 # Author: fmontorsi
 # Created: Apr 2024
@@ -18,6 +32,28 @@ from importlib.metadata import PackageNotFoundError
 #
 
 
+log = logging.getLogger(__name__)
+
+
+# =======================================================================================================
+# Helpers
+# =======================================================================================================
+
+
+@functools.cache
+def get_app_version() -> str:
+    """
+    Returns the version of this application, read from the metadata of the installed package.
+    The result is cached since the lookup requires scanning the installed packages on disk.
+    """
+    try:
+        return str(version(MiscAppDefaults.THIS_APP_NAME))
+    except PackageNotFoundError:
+        # this happens when e.g. running unit tests inside Github runners where the wheel
+        # package for this project is not installed:
+        return "N/A"
+
+
 # =======================================================================================================
 # AppConfig
 # =======================================================================================================
@@ -33,108 +69,154 @@ class AppConfig:
     with their defaults. All default constants are stored in constants.py
     """
 
+    # the set of attributes is fixed: using slots makes attribute access faster and avoids a per-instance __dict__
+    __slots__ = (
+        "config",
+        "current_hostname",
+        "disable_hw",
+        "gpio_inputs_map",
+        "mqtt_identifier_prefix",
+        "optoisolated_inputs_map",
+        "outputs_map",
+        "verbose",
+    )
+
+    # default values for the optional keys of the 'mqtt' and 'home_assistant' sections of each config entry;
+    # the topics are not listed here since their defaults depend on the entry name.
+    # These are shared by all instances, so they are read-only mappings:
+    mqtt_payload_defaults: ClassVar[Mapping] = MappingProxyType(
+        {"payload_on": MqttDefaults.PAYLOAD_ON, "payload_off": MqttDefaults.PAYLOAD_OFF}
+    )
+    home_assistant_defaults_for_inputs: ClassVar[Mapping] = MappingProxyType(
+        {
+            "expire_after": HomeAssistantDefaults.EXPIRE_AFTER_SEC,
+            "icon": None,
+            "platform": "binary_sensor",
+        }
+    )
+    home_assistant_defaults_for_outputs: ClassVar[Mapping] = MappingProxyType(
+        {
+            "expire_after": HomeAssistantDefaults.EXPIRE_AFTER_SEC,
+            "icon": None,
+            "platform": "switch",
+        }
+    )
+
+    # the schemas are built once, when this class is defined, and shared by all instances:
+    mqtt_schema_for_sensor_on_and_off: ClassVar[Schema] = Schema(
+        {
+            Optional("topic"): str,
+            # the 'state_topic' makes sense only for OUTPUTs that have type=switch in HomeAssistant and
+            # are required to publish a state topic
+            Optional("state_topic"): str,
+            Optional("payload_on"): str,
+            Optional("payload_off"): str,
+        }
+    )
+    mqtt_schema_for_edge_triggered_sensor: ClassVar[Schema] = Schema(
+        {
+            Optional("topic"): str,
+            # for edge-triggered sensors it's hard to propose a meaningful default payload...so it's not optional
+            "payload": str,
+            # burst of activations closer than this interval produce a single MQTT message
+            Optional("debounce_msec"): And(int, lambda n: n >= 0, error="debounce_msec must be >= 0"),
+        }
+    )
+    home_assistant_schema_for_inputs: ClassVar[Schema] = Schema(
+        {
+            # device_class is required because it's hard to guess...
+            "device_class": str,
+            # the platform defaults to 'binary_sensor' for inputs and it's the only one supported for now
+            Optional("platform"): "binary_sensor",
+            Optional("expire_after"): int,
+            Optional("icon"): str,
+        }
+    )
+    home_assistant_schema_for_outputs: ClassVar[Schema] = Schema(
+        {
+            # device_class is required because it's hard to guess...
+            "device_class": str,
+            # the platform defaults to 'switch' for outputs
+            Optional("platform"): Or("switch", "button"),
+            Optional("expire_after"): int,
+            Optional("icon"): str,
+        }
+    )
+
+    config_file_schema: ClassVar[Schema] = Schema(
+        {
+            "mqtt_broker": {
+                "host": str,
+                Optional("port"): int,
+                Optional("reconnection_period_msec"): int,
+                Optional("user"): str,
+                Optional("password"): str,
+            },
+            Optional("home_assistant"): {
+                Optional("default_topic_prefix"): str,
+                Optional("publish_period_msec"): int,
+                Optional("discovery_messages"): {
+                    Optional("enable"): bool,
+                    Optional("topic_prefix"): str,
+                    Optional("node_id"): str,
+                },
+            },
+            Optional("log_stats_every"): int,
+            Optional("cpu_affinity"): int,
+            Optional("i2c_optoisolated_inputs"): [
+                {
+                    "name": Regex(r"^[a-z0-9_]+$"),
+                    Optional("description"): str,
+                    # the Sequent Microsystem HAT only handles 16 inputs
+                    "input_num": And(
+                        int,
+                        lambda n: 1 <= n <= SeqMicroHatConstants.MAX_CHANNELS,
+                        error=f"input_num must be in the range [1-{SeqMicroHatConstants.MAX_CHANNELS}]",
+                    ),
+                    "active_low": bool,
+                    Optional("mqtt"): mqtt_schema_for_sensor_on_and_off,
+                    "home_assistant": home_assistant_schema_for_inputs,
+                }
+            ],
+            Optional("gpio_inputs"): [
+                {
+                    "name": Regex(r"^[a-z0-9_]+$"),
+                    Optional("description"): str,
+                    "gpio": int,
+                    "active_low": bool,
+                    # mqtt is NOT optional for GPIO inputs... we need to have a meaningful payload to send
+                    "mqtt": mqtt_schema_for_edge_triggered_sensor,
+                    # home_assistant is not allowed for GPIO inputs, since they do not create binary_sensors
+                }
+            ],
+            Optional("outputs"): [
+                {
+                    "name": Regex(r"^[a-z0-9_]+$"),
+                    Optional("description"): str,
+                    "gpio": int,
+                    "active_low": bool,
+                    Optional("mqtt"): mqtt_schema_for_sensor_on_and_off,
+                    "home_assistant": home_assistant_schema_for_outputs,
+                }
+            ],
+        }
+    )
+
     def __init__(self):
         self.config = None
         self.optoisolated_inputs_map = None  # None means "not loaded at all"
+        self.gpio_inputs_map = None
+        self.outputs_map = None
 
         # config options related to CLI options:
         self.disable_hw = False  # can be get/set from the outside
         self.verbose = False
 
-        # technically speaking the version is not an "app config" but centralizing it here is handy
-        try:
-            self.app_version = str(version(MiscAppDefaults.THIS_APP_NAME))
-        except PackageNotFoundError:
-            # this happens when e.g. running unit tests inside Github runners where the wheel
-            # package for this project is not installed:
-            self.app_version = "N/A"
-
         self.current_hostname = platform.node()
 
         # before launching MQTT connections, define a unique MQTT prefix identifier:
         self.mqtt_identifier_prefix = "rpi2home_assistant_" + datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
 
-        self.mqtt_schema_for_sensor_on_and_off = Schema(
-            {
-                Optional("topic"): str,
-                # the 'state_topic' makes sense only for OUTPUTs that have type=switch in HomeAssistant and
-                # are required to publish a state topic
-                Optional("state_topic"): str,
-                Optional("payload_on"): str,
-                Optional("payload_off"): str,
-            }
-        )
-        self.mqtt_schema_for_edge_triggered_sensor = Schema(
-            {
-                Optional("topic"): str,
-                # for edge-triggered sensors it's hard to propose a meaningful default payload...so it's not optional
-                "payload": str,
-            }
-        )
-        self.home_assistant_schema = Schema(
-            {
-                # device_class is required because it's hard to guess...
-                "device_class": str,
-                # the platform defaults to 'binary_sensor' for inputs and to 'switch' for outputs
-                Optional("platform"): str,
-                Optional("expire_after"): int,
-                Optional("icon"): str,
-            }
-        )
-
-        self.config_file_schema = Schema(
-            {
-                "mqtt_broker": {
-                    "host": str,
-                    Optional("port"): int,
-                    Optional("reconnection_period_msec"): int,
-                    Optional("user"): str,
-                    Optional("password"): str,
-                },
-                Optional("home_assistant"): {
-                    Optional("default_topic_prefix"): str,
-                    Optional("publish_period_msec"): int,
-                    Optional("discovery_messages"): {
-                        Optional("enable"): bool,
-                        Optional("topic_prefix"): str,
-                        Optional("node_id"): str,
-                    },
-                },
-                Optional("log_stats_every"): int,
-                Optional("i2c_optoisolated_inputs"): [
-                    {
-                        "name": Regex(r"^[a-z0-9_]+$"),
-                        Optional("description"): str,
-                        "input_num": int,
-                        "active_low": bool,
-                        Optional("mqtt"): self.mqtt_schema_for_sensor_on_and_off,
-                        "home_assistant": self.home_assistant_schema,
-                    }
-                ],
-                Optional("gpio_inputs"): [
-                    {
-                        "name": Regex(r"^[a-z0-9_]+$"),
-                        Optional("description"): str,
-                        "gpio": int,
-                        "active_low": bool,
-                        # mqtt is NOT optional for GPIO inputs... we need to have a meaningful payload to send
-                        "mqtt": self.mqtt_schema_for_edge_triggered_sensor,
-                        # home_assistant is not allowed for GPIO inputs, since they do not create binary_sensors
-                    }
-                ],
-                Optional("outputs"): [
-                    {
-                        "name": Regex(r"^[a-z0-9_]+$"),
-                        Optional("description"): str,
-                        "gpio": int,
-                        "active_low": bool,
-                        Optional("mqtt"): self.mqtt_schema_for_sensor_on_and_off,
-                        "home_assistant": self.home_assistant_schema,
-                    }
-                ],
-            }
-        )
-
     def check_gpio(self, idx: int):
         reserved_gpios = [
             SeqMicroHatConstants.SHUTDOWN_BUTTON_GPIO,
@@ -152,9 +234,17 @@ class AppConfig:
                 f"Invalid GPIO index {idx}: that GPIO pin is reserved for communication with the Sequent Microsystem HAT. Choose a different GPIO."
             )
 
+    def check_unique_name(self, name: str, name_set: set):
+        if name in name_set:
+            raise ValueError(
+                f"Invalid name [{name}]: such name has already been used by another entry. Check again the configuration."
+            )
+        name_set.add(name)
+
     def populate_defaults_in_list_entry(
         self,
         entry_dict: dict,
+        topic_prefix: str,
         populate_mqtt: bool = True,
         populate_homeassistant: bool = True,
         has_payload_on_off: bool = True,
@@ -165,26 +255,25 @@ class AppConfig:
             entry_dict["description"] = entry_dict["name"]
 
         if populate_mqtt:
-            if "mqtt" not in entry_dict:
-                entry_dict["mqtt"] = {}
+            # always work on a copy of the 'mqtt' section: the same dict might be shared by several entries
+            # (e.g. via YAML anchors/aliases) and the per-entry topics must not leak into the other entries:
+            entry_dict["mqtt"] = dict(entry_dict.get("mqtt", {}))
 
             # an optional entry is the 'topic':
             if "topic" not in entry_dict["mqtt"]:
-                entry_dict["mqtt"]["topic"] = f"{self.homeassistant_default_topic_prefix}/{entry_dict['name']}"
-                print(f"Topic for {entry_dict['name']} defaults to [{entry_dict['mqtt']['topic']}]")
+                entry_dict["mqtt"]["topic"] = f"{topic_prefix}/{entry_dict['name']}"
+                log.debug("Topic for %s defaults to [%s]", entry_dict["name"], entry_dict["mqtt"]["topic"])
 
             if has_state_topic:
                 if "state_topic" not in entry_dict["mqtt"]:
-                    entry_dict["mqtt"][
-                        "state_topic"
-                    ] = f"{self.homeassistant_default_topic_prefix}/{entry_dict['name']}/state"
-                    print(f"State topic for {entry_dict['name']} defaults to [{entry_dict['mqtt']['state_topic']}]")
+                    entry_dict["mqtt"]["state_topic"] = f"{topic_prefix}/{entry_dict['name']}/state"
+                    log.debug(
+                        "State topic for %s defaults to [%s]", entry_dict["name"], entry_dict["mqtt"]["state_topic"]
+                    )
 
             if has_payload_on_off:
-                if "payload_on" not in entry_dict["mqtt"]:
-                    entry_dict["mqtt"]["payload_on"] = MqttDefaults.PAYLOAD_ON
-                if "payload_off" not in entry_dict["mqtt"]:
-                    entry_dict["mqtt"]["payload_off"] = MqttDefaults.PAYLOAD_OFF
+                # keys given in the config file override the defaults:
+                entry_dict["mqtt"] = {**AppConfig.mqtt_payload_defaults, **entry_dict["mqtt"]}
 
         if populate_homeassistant:
             # the following assertion is justified because 'schema' library should garantuee
@@ -192,35 +281,126 @@ class AppConfig:
             assert "home_assistant" in entry_dict
 
             if "expire_after" not in entry_dict["home_assistant"]:
-                entry_dict["home_assistant"]["expire_after"] = HomeAssistantDefaults.EXPIRE_AFTER_SEC
-                print(f"Expire-after for {entry_dict['name']} defaults to [{HomeAssistantDefaults.EXPIRE_AFTER_SEC}]")
-            if "icon" not in entry_dict["home_assistant"]:
-                entry_dict["home_assistant"]["icon"] = None
-            if "platform" not in entry_dict["home_assistant"]:
-                entry_dict["home_assistant"]["platform"] = "switch" if is_output else "binary_sensor"
+                log.debug(
+                    "Expire-after for %s defaults to [%s]", entry_dict["name"], HomeAssistantDefaults.EXPIRE_AFTER_SEC
+                )
+            defaults = (
+                AppConfig.home_assistant_defaults_for_outputs
+                if is_output
+                else AppConfig.home_assistant_defaults_for_inputs
+            )
+            # this creates a new dict for each entry, so the 'home_assistant' sections are never shared:
+            entry_dict["home_assistant"] = {**defaults, **entry_dict["home_assistant"]}
 
         return entry_dict
 
-    def load(self, cfg_yaml: str) -> bool:
-        print(f"Loading configuration file {cfg_yaml}")
+    def parse_config_file(self, cfg_yaml: str, cache_dir: str | None = None) -> tuple:
+        """
+        Parses the YAML config file and returns its contents, together with the (path, contents) of the cache file
+        that should be written once the contents have been validated (None if no cache file needs to be written).
+        Since parsing YAML is slow (especially on a Raspberry PI), the parsed contents are cached in a JSON file
+        stored inside 'cache_dir'; the cache is reused as long as the YAML file is not modified and the cache
+        was written by the same version of this app. A None 'cache_dir' disables the cache.
+        Config files having the ".json" extension are instead parsed directly as JSON, without any cache.
+        """
+        # NOTE: files are opened in binary mode: both the YAML and the JSON parsers detect and decode
+        #       the UTF-8 encoding by themselves, so there's no need for an additional text-decoding layer
+        if cfg_yaml.endswith(".json"):
+            with open(cfg_yaml, "rb") as file:
+                return json.load(file), None
+
+        if cache_dir is None:
+            with open(cfg_yaml, "rb") as file:
+                return yaml.load(file, Loader=YamlSafeLoader), None
+
+        cache_file = os.path.join(cache_dir, os.path.basename(cfg_yaml) + MiscAppDefaults.CONFIG_CACHE_SUFFIX)
+        yaml_stat = os.stat(cfg_yaml)
+        cache_key = {
+            "path": os.path.abspath(cfg_yaml),
+            "mtime_ns": yaml_stat.st_mtime_ns,
+            "size": yaml_stat.st_size,
+            "version": self.app_version,
+        }
+
+        try:
+            with open(cache_file, "rb") as file:
+                cache = json.load(file)
+            if {k: cache[k] for k in cache_key} == cache_key:
+                log.info(f"Using cached contents of the configuration file from {cache_file}")
+                return cache["config"], None
+        except (OSError, ValueError, KeyError, TypeError):
+            # the cache file is missing or it is corrupted: just parse the YAML file
+            pass
+
+        with open(cfg_yaml, "rb") as file:
+            config = yaml.load(file, Loader=YamlSafeLoader)
+
+        # serialize the cache contents right away: load() fills the defaults directly inside the parsed config
+        try:
+            return config, (cache_file, json.dumps({**cache_key, "config": config}))
+        except (ValueError, TypeError) as e:
+            log.warning(f"Could not serialize the contents of the configuration file '{cfg_yaml}' for caching: {e}")
+            return config, None
+
+    def write_config_cache(self, cache_file: str, cache_contents: str):
+        """
+        Stores the given contents in the cache file. The cache holds a copy of the whole configuration,
+        including the MQTT broker credentials, so it is made accessible only by the owner of this process.
+        """
+        # write the cache to a temporary file and then rename it: the rename is atomic, so a concurrent
+        # reader or a crash during the write can never leave a truncated cache file around
+        tmp_cache_file = f"{cache_file}.{os.getpid()}.tmp"
         try:
-            with open(cfg_yaml, "r") as file:
-                self.config = yaml.safe_load(file)
+            os.makedirs(os.path.dirname(cache_file), mode=0o700, exist_ok=True)
+            # NOTE: the file mode passed to os.open() is applied when the file gets created, so the cache contents
+            #       are never readable by other users, not even temporarily; O_NOFOLLOW avoids writing through
+            #       a symlink planted in place of the temporary file
+            fd = os.open(tmp_cache_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_NOFOLLOW, 0o600)
+            with os.fdopen(fd, "w") as file:
+                file.write(cache_contents)
+            os.replace(tmp_cache_file, cache_file)
+        except OSError as e:
+            # this happens e.g. when this app does not run as root
+            log.warning(f"Could not write the configuration cache file '{cache_file}': {e}")
+            try:
+                os.remove(tmp_cache_file)
+            except FileNotFoundError:
+                pass  # the temporary file was not even created
+            except OSError as remove_err:
+                log.warning(f"Could not remove the temporary configuration cache file '{tmp_cache_file}': {remove_err}")
+
+    def load(self, cfg_yaml: str, cache_dir: str | None = None) -> bool:
+        """
+        Loads and validates the given config file. When 'cache_dir' is provided, the parsed contents of the
+        config file are cached inside that directory (see parse_config_file()).
+        """
+        log.info(f"Loading configuration file {cfg_yaml}")
+        try:
+            self.config, pending_cache = self.parse_config_file(cfg_yaml, cache_dir)
         except FileNotFoundError:
-            print(f"Error: configuration file '{cfg_yaml}' not found.")
+            log.error(f"Error: configuration file '{cfg_yaml}' not found.")
             return False
         except yaml.YAMLError as e:
-            print(f"Error parsing YAML config file '{cfg_yaml}': {e}")
+            log.error(f"Error parsing YAML config file '{cfg_yaml}': {e}")
+            return False
+        except json.JSONDecodeError as e:
+            log.error(f"Error parsing JSON config file '{cfg_yaml}': {e}")
             return False
 
-        # validate the config against its schema:
+        # validate the config against its schema; this guarantees that all mandatory keys are present,
+        # so the parsing code below does not need to handle KeyError:
         try:
             self.config_file_schema.validate(self.config)
         except SchemaError as e:
-            print("Failed YAML config file validation. Error follows.")
-            print(e)
+            log.error(f"Failed YAML config file validation. Error follows.\n{e}")
             return False
 
+        # the 'name' of each entry must be unique across all configuration sections:
+        name_set = set()
+
+        # the default MQTT topics of all entries share the same prefix: read it only once
+        topic_prefix = self.homeassistant_default_topic_prefix
+
         try:
             # convert the 'i2c_optoisolated_inputs' part in a dictionary indexed by the DIGITAL INPUT CHANNEL NUMBER:
             self.optoisolated_inputs_map = {}
@@ -230,24 +410,19 @@ class AppConfig:
                 self.config["i2c_optoisolated_inputs"] = []
 
             for input_item in self.config["i2c_optoisolated_inputs"]:
-                input_item = self.populate_defaults_in_list_entry(input_item, has_state_topic=False, is_output=False)
+                input_item = self.populate_defaults_in_list_entry(
+                    input_item, topic_prefix, has_state_topic=False, is_output=False
+                )
+                self.check_unique_name(input_item["name"], name_set)
 
-                # check GPIO index
+                # check GPIO index (its range has already been validated by the schema)
                 idx = int(input_item["input_num"])
-                if idx < 1 or idx > 16:
-                    raise ValueError(
-                        f"Invalid input_num {idx} for entry [{input_item['name']}]: the legal range is [1-16] since the Sequent Microsystem HAT only handles 16 inputs."
-                    )
                 if idx in self.optoisolated_inputs_map:
                     raise ValueError(
                         f"Invalid input_num {idx} for entry [{input_item['name']}]: such index for the Sequent Microsystem HAT input has already been used. Check again the configuration."
                     )
 
-                # check HomeAssistant section
-                if input_item["home_assistant"]["platform"] != "binary_sensor":
-                    raise ValueError(
-                        f"Invalid Home Assistant platform value [{input_item['home_assistant']['platform']}] for entry [{input_item['name']}]: only the 'binary_sensor' platform is supported for now."
-                    )
+                # check HomeAssistant section (the platform has already been validated by the schema)
                 if (
                     input_item["home_assistant"]["device_class"]
                     not in HomeAssistantDefaults.ALLOWED_DEVICE_CLASSES["binary_sensor"]
@@ -258,16 +433,12 @@ class AppConfig:
 
                 # store as valid entry
                 self.optoisolated_inputs_map[idx] = input_item
-                # print(input_item)
-            print(f"Loaded {len(self.optoisolated_inputs_map)} opto-isolated input configurations")
+            log.debug(f"Loaded {len(self.optoisolated_inputs_map)} opto-isolated input configurations")
             if len(self.optoisolated_inputs_map) == 0:
                 # reset to "not loaded at all" condition
                 self.optoisolated_inputs_map = None
         except ValueError as e:
-            print(f"Error in YAML config file '{cfg_yaml}': {e}")
-            return False
-        except KeyError as e:
-            print(f"Error in YAML config file '{cfg_yaml}': {e} is missing")
+            log.error(f"Error in YAML config file '{cfg_yaml}': {e}")
             return False
 
         try:
@@ -281,11 +452,15 @@ class AppConfig:
             for input_item in self.config["gpio_inputs"]:
                 input_item = self.populate_defaults_in_list_entry(
                     input_item,
+                    topic_prefix,
                     populate_homeassistant=False,
                     has_payload_on_off=False,
                     has_state_topic=False,
                     is_output=False,
                 )
+                if "debounce_msec" not in input_item["mqtt"]:
+                    input_item["mqtt"]["debounce_msec"] = 0  # default value: no debouncing
+                self.check_unique_name(input_item["name"], name_set)
 
                 # check GPIO index
                 idx = int(input_item["gpio"])
@@ -297,16 +472,12 @@ class AppConfig:
 
                 # store as valid entry
                 self.gpio_inputs_map[idx] = input_item
-                # print(input_item)
-            print(f"Loaded {len(self.gpio_inputs_map)} GPIO input configurations")
+            log.debug(f"Loaded {len(self.gpio_inputs_map)} GPIO input configurations")
             if len(self.gpio_inputs_map) == 0:
                 # reset to "not loaded at all" condition
                 self.gpio_inputs_map = None
         except ValueError as e:
-            print(f"Error in YAML config file '{cfg_yaml}': {e}")
-            return False
-        except KeyError as e:
-            print(f"Error in YAML config file '{cfg_yaml}': {e} is missing")
+            log.error(f"Error in YAML config file '{cfg_yaml}': {e}")
             return False
 
         try:
@@ -318,7 +489,8 @@ class AppConfig:
                 self.config["outputs"] = []
 
             for output_item in self.config["outputs"]:
-                output_item = self.populate_defaults_in_list_entry(output_item)
+                output_item = self.populate_defaults_in_list_entry(output_item, topic_prefix)
+                self.check_unique_name(output_item["name"], name_set)
 
                 # check GPIO index
                 idx = int(output_item["gpio"])
@@ -330,12 +502,7 @@ class AppConfig:
                         f"Invalid MQTT topic [{mqtt_topic}] for entry [{output_item['name']}]: such MQTT topic has already been used. Check again the configuration."
                     )
 
-                # check HomeAssistant section
-                if output_item["home_assistant"]["platform"] not in ["switch", "button"]:
-                    raise ValueError(
-                        f"Invalid Home Assistant platform value [{output_item['home_assistant']['platform']}] for entry [{output_item['name']}]: only the 'switch' or 'button' platforms are supported for now."
-                    )
-
+                # check HomeAssistant section (the platform has already been validated by the schema)
                 allowed_dev_classes = HomeAssistantDefaults.ALLOWED_DEVICE_CLASSES[
                     output_item["home_assistant"]["platform"]
                 ]
@@ -346,36 +513,19 @@ class AppConfig:
 
                 # store as valid entry
                 self.outputs_map[mqtt_topic] = output_item
-                # print(output_item)
-            print(f"Loaded {len(self.outputs_map)} digital output configurations")
+            log.debug(f"Loaded {len(self.outputs_map)} digital output configurations")
             if len(self.outputs_map) == 0:
                 # reset to "not loaded at all" condition
                 self.outputs_map = None
         except ValueError as e:
-            print(f"Error in YAML config file '{cfg_yaml}': {e}")
-            return False
-        except KeyError as e:
-            print(f"Error in YAML config file '{cfg_yaml}': {e} is missing")
+            log.error(f"Error in YAML config file '{cfg_yaml}': {e}")
             return False
 
-        # validate that there is no duplicated 'name' across all configuration entries
-        name_set = set()
-        merged_entries_list = []
-        if self.optoisolated_inputs_map is not None:
-            merged_entries_list = merged_entries_list + list(self.optoisolated_inputs_map.values())
-        if self.gpio_inputs_map is not None:
-            merged_entries_list = merged_entries_list + list(self.gpio_inputs_map.values())
-        if self.outputs_map is not None:
-            merged_entries_list = merged_entries_list + list(self.outputs_map.values())
-        for entry in merged_entries_list:
-            if entry["name"] in name_set:
-                print(
-                    f"Error in YAML config file '{cfg_yaml}': the name {entry['name']} is not unique across the configuration."
-                )
-            else:
-                name_set.add(entry["name"])
+        # the cache is written only for config files that passed all the checks above:
+        if pending_cache is not None:
+            self.write_config_cache(*pending_cache)
 
-        print("Successfully loaded configuration")
+        log.info("Successfully loaded configuration")
         return True
 
     def merge_options_from_cli(self, args: dict):
@@ -425,9 +575,15 @@ class AppConfig:
             i += 1
         print("** MISC:")
         print(f"   Log stats every: {self.stats_log_period_sec}s")
+        print(f"   CPU affinity: {self.cpu_affinity if self.cpu_affinity is not None else 'none'}")
 
     # MQTT
 
+    @property
+    def app_version(self) -> str:
+        # technically speaking the version is not an "app config" but centralizing it here is handy
+        return get_app_version()
+
     @property
     def mqtt_broker_host(self) -> str:
         if self.config is None:
@@ -544,6 +700,12 @@ class AppConfig:
             return MiscAppDefaults.STATS_LOG_PERIOD_SEC  # default value
         return int(self.config["log_stats_every"])
 
+    @property
+    def cpu_affinity(self) -> int:
+        if self.config is None or "cpu_affinity" not in self.config:
+            return None  # default value: do not pin the process to any CPU core
+        return int(self.config["cpu_affinity"])
+
     #
     # OPTO-ISOLATED INPUTS
     #
@@ -554,9 +716,9 @@ class AppConfig:
         valid for an opto-isolated input config (see the SCHEMA in the load() API),
         including optional keys that were not given in the YAML.
         """
-        if self.optoisolated_inputs_map is None or index not in self.optoisolated_inputs_map:
+        if self.optoisolated_inputs_map is None:
             return None  # no meaningful default value
-        return self.optoisolated_inputs_map[index]
+        return self.optoisolated_inputs_map.get(index)  # a single hash lookup; None if not configured
 
     def get_all_optoisolated_inputs(self) -> list:
         """
@@ -576,9 +738,9 @@ class AppConfig:
         valid for a GPIO input config (see the SCHEMA in the load() API),
         including optional keys that were not given in the YAML.
         """
-        if self.gpio_inputs_map is None or index not in self.gpio_inputs_map:
+        if self.gpio_inputs_map is None:
             return None  # no meaningful default value
-        return self.gpio_inputs_map[index]
+        return self.gpio_inputs_map.get(index)  # a single hash lookup; None if not configured
 
     def get_all_gpio_inputs(self) -> list:
         """
@@ -598,9 +760,9 @@ class AppConfig:
         valid for a GPIO output config (see the SCHEMA in the load() API),
         including optional keys that were not given in the YAML.
         """
-        if self.outputs_map is None or topic not in self.outputs_map:
+        if self.outputs_map is None:
             return None  # no meaningful default value
-        return self.outputs_map[topic]
+        return self.outputs_map.get(topic)  # a single hash lookup; None if not configured
 
     def get_all_outputs(self) -> list:
         """
@@ -613,12 +775,19 @@ class AppConfig:
     #
     # MQTT HELPERs
     #
-    def create_aiomqtt_client(self, identifier_str: str) -> aiomqtt.Client:
+    def create_aiomqtt_client(self, identifier_str: str, persistent_session: bool = False) -> aiomqtt.Client:
         """
         Creates an aiomqtt client based on the configuration information provided to this app.
         The 'identifier_str' can be used to uniquely name the client connection.
         Such unique name appears in MQTT broker logs and is useful for debug.
+        When 'persistent_session' is True, the broker keeps the session state (subscriptions and queued
+        QoS>0 messages) for up to MqttDefaults.SESSION_EXPIRY_INTERVAL_SEC seconds after a disconnection,
+        and resumes it when the client reconnects with the same identifier.
         """
+        connect_properties = None
+        if persistent_session:
+            connect_properties = Properties(PacketTypes.CONNECT)
+            connect_properties.SessionExpiryInterval = MqttDefaults.SESSION_EXPIRY_INTERVAL_SEC
         return aiomqtt.Client(
             hostname=self.mqtt_broker_host,
             port=self.mqtt_broker_port,
@@ -626,6 +795,9 @@ class AppConfig:
             username=self.mqtt_broker_user,
             password=self.mqtt_broker_password,
             identifier=self.mqtt_identifier_prefix + identifier_str,
+            protocol=aiomqtt.ProtocolVersion.V5,
+            clean_start=not persistent_session,
+            properties=connect_properties,
         )
 
     def get_device_dict(self) -> dict:
@@ -9,6 +9,7 @@
 
 # MQTT constants
 class MqttQOS:
+    AT_MOST_ONCE = 0
     AT_LEAST_ONCE = 1
 
 
@@ -17,6 +18,9 @@ class MqttDefaults:
     PAYLOAD_OFF = "OFF"
     BROKER_PORT = 1883
     RECONNECTION_PERIOD_SEC = 1
+    # how long the broker keeps the session of a disconnected persistent client: output commands queued by the broker
+    # meanwhile get applied after reconnecting, so this must be short enough that such commands are not stale
+    SESSION_EXPIRY_INTERVAL_SEC = 5
 
 
 # HomeAssistant constants/defaults
@@ -75,6 +79,9 @@ class SeqMicroHatConstants:
     INTERRUPT_GPIO = 11  # GPIO pin connected to the interrupt line of the I/O expander (need pullup resistor)
     I2C_SDA = 2  # reserved for I2C communication between Raspberry CPU and the input HAT
     I2C_SCL = 3  # reserved for I2C communication between Raspberry CPU and the input HAT
+    I2C_BUS = 1  # the I2C bus of the Raspberry PI connected to the HAT, i.e. /dev/i2c-1
+    I2C_BASE_ADDRESS = 0x20  # I2C address of the I/O expander of the input HAT, for stack level 7
+    I2C_INPUTS_REGISTER = 0  # register of the I/O expander which contains the 16 inputs (active low)
 
 
 # Generic app constants/defaults
@@ -83,7 +90,10 @@ class MiscAppDefaults:
 
     # File paths constants
     CONFIG_FILE = "/etc/rpi2home-assistant.yaml"
+    CONFIG_CACHE_DIRECTORY = "/var/cache/rpi2home-assistant"  # where the parsed config file is cached
+    CONFIG_CACHE_SUFFIX = ".cache.json"  # the cached config file is named after the config file, adding this suffix
     INTEGRATION_TESTS_OUTPUT_FILE = "/tmp/integration-tests-output"
+    LOCK_FILE_DIRECTORY = "/run"  # tmpfs directory for runtime state, cleaned at each boot
 
     # Misc constants
     STATS_LOG_PERIOD_SEC = 30
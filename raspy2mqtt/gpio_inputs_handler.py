@@ -1,9 +1,10 @@
 #!/usr/bin/env python3
 
+import array
 import gpiozero
 import signal
 import asyncio
-import queue
+import logging
 import sys
 import aiomqtt
 from raspy2mqtt.constants import MqttQOS
@@ -15,6 +16,17 @@ from raspy2mqtt.config import AppConfig
 # License: Apache license
 #
 
+log = logging.getLogger(__name__)
+
+# indexes of the counters inside the stats array
+STAT_NUM_CONNECTIONS_PUBLISH = 0
+STAT_NUM_GPIO_NOTIFICATIONS = 1
+STAT_NUM_MQTT_MESSAGES = 2
+STAT_NUM_DEBOUNCED_NOTIFICATIONS = 3
+STAT_ERROR_NOCONFIG = 4
+STAT_ERROR_NUM_CONNECTIONS_LOST = 5
+NUM_STATS = 6
+
 # =======================================================================================================
 # GpioInputsHandler
 # =======================================================================================================
@@ -29,123 +41,144 @@ class GpioInputsHandler:
     # the stop-request is not related to a particular instance of this class... it applies to any instance
     stop_requested = False
 
-    # the MQTT client identifier
-    client_identifier = "_gpio_publisher"
+    # the stats counters which keep increasing even when nothing happens (e.g. because of periodic publishing)
+    periodic_stats = ()
 
     def __init__(self):
-        # thread-safe queue to communicate from GPIOzero secondary threads to main thread
-        self.gpio_queue = queue.Queue()
+        # queue to communicate from GPIOzero secondary threads to the main thread (which runs the event loop);
+        # NOTE: asyncio.Queue is not thread-safe, so it must be fed using loop.call_soon_threadsafe()
+        self.gpio_queue = asyncio.Queue()
 
         # in case integration tests are running:
         self.last_emulated_gpio_number = 0
 
-        self.stats = {
-            "num_connections_publish": 0,
-            "num_gpio_notifications": 0,
-            "num_mqtt_messages": 0,
-            "ERROR_noconfig": 0,
-            "ERROR_num_connections_lost": 0,
-        }
-
-    def on_gpio_input(self, device):
-        """
-        This is a gpiozero callback function.
-        Remember: gpiozero will invoke such functions from a SECONDARY thread. That's why we use a
-        thread-safe queue to communicate back to the main thread (which runs the event loop)
-        """
-        print(f"!! Detected activation of GPIO{device.pin.number} !! ")
-        self.gpio_queue.put(device.pin.number)
+        # counters for this handler, indexed by the STAT_* constants
+        self.stats = array.array("Q", [0] * NUM_STATS)
 
-    async def emulate_gpio_input(self, sig: signal.Signals) -> None:
+    def emulate_gpio_input(self, sig: signal.Signals) -> None:
         """
         Used for integration tests.
         Emulates a GPIO input activation
         """
         self.last_emulated_gpio_number += 1
-        print(f"Received signal {sig.name}: emulating press of GPIO {self.last_emulated_gpio_number}")
-        self.gpio_queue.put(self.last_emulated_gpio_number)
+        log.info(f"Received signal {sig.name}: emulating press of GPIO {self.last_emulated_gpio_number}")
+        self.gpio_queue.put_nowait(self.last_emulated_gpio_number)
 
     def init_hardware(self, cfg: AppConfig, loop: asyncio.BaseEventLoop) -> list[gpiozero.Button]:
         buttons = []
 
         if cfg.disable_hw:
-            print("Skipping GPIO inputs HW initialization (--disable-hw was given)")
+            log.info("Skipping GPIO inputs HW initialization (--disable-hw was given)")
 
             for sig in [signal.SIGUSR1, signal.SIGUSR2]:
-                loop.add_signal_handler(sig, lambda: asyncio.create_task(self.emulate_gpio_input(sig)))
+                # NOTE: pass 'sig' as argument of the callback to bind its current value
+                loop.add_signal_handler(sig, self.emulate_gpio_input, sig)
 
         else:
 
             # setup GPIO pins for the INPUTs
-            print("Initializing GPIO input pins")
+            log.info("Initializing GPIO input pins")
+            enqueue_gpio = self.gpio_queue.put_nowait
             for input_ch in cfg.get_all_gpio_inputs():
-                # the short hold-time is to ensure that the digital input is served ASAP (i.e. on_gpio_input gets
-                # invoked almost immediately)
+                # the short hold-time is to ensure that the digital input is served ASAP (i.e. the when_held
+                # callback gets invoked almost immediately)
                 active_high = not bool(input_ch["active_low"])
                 b = gpiozero.Button(input_ch["gpio"], hold_time=0.1, pull_up=None, active_state=active_high)
-                b.when_held = self.on_gpio_input
+
+                # Remember: gpiozero will invoke the callback from a SECONDARY thread. That's why the callback
+                # does nothing else than asking the event loop (which runs in the main thread) to enqueue the
+                # GPIO number on our behalf; logging and everything else happens in the main thread
+                b.when_held = lambda gpio=input_ch["gpio"]: loop.call_soon_threadsafe(enqueue_gpio, gpio)
                 buttons.append(b)
 
         return buttons
 
-    async def process_gpio_inputs_queue_and_publish(self, cfg: AppConfig):
+    async def process_gpio_inputs_queue_and_publish(self, cfg: AppConfig, client: aiomqtt.Client):
         """
         Publishes over MQTT a message each time a GPIO input changes status.
+        The MQTT 'client' is shared with other coroutines: in case the connection to the broker gets lost,
+        the aiomqtt.MqttError is propagated to the caller, which takes care of reconnecting.
         This function can be gracefully stopped by setting the
          GpioInputsHandler.stop_requested
         class variable to true.
         """
+        self.stats[STAT_NUM_CONNECTIONS_PUBLISH] += 1
+
+        # resolve once the MQTT topic, the MQTT payload (also already encoded) and the debounce interval
+        # associated with each GPIO input:
+        mqtt_messages_by_gpio = {
+            input_ch["gpio"]: (
+                input_ch["mqtt"]["topic"],
+                input_ch["mqtt"]["payload"],
+                input_ch["mqtt"]["payload"].encode("UTF-8"),
+                input_ch["mqtt"]["debounce_msec"] / 1000.0,
+            )
+            for input_ch in cfg.get_all_gpio_inputs()
+        }
+
+        # time of the last MQTT message published for each GPIO input, in the event loop clock:
+        loop = asyncio.get_running_loop()
+        last_published_sec_by_gpio = {}
+
+        try:
+            while not GpioInputsHandler.stop_requested:
+                # wait for the next notification coming from the gpiozero secondary thread:
+                # this does not block the event loop and resumes as soon as a GPIO input gets activated
+                gpio_numbers = [await self.gpio_queue.get()]
+
+                # in case of a burst of GPIO activations, process all the queued notifications together,
+                # sending all the MQTT messages back-to-back:
+                while not self.gpio_queue.empty():
+                    gpio_numbers.append(self.gpio_queue.get_nowait())
+
+                publish_coroutines = []
+                for gpio_number in gpio_numbers:
+                    mqtt_message = mqtt_messages_by_gpio.get(gpio_number)
+                    self.stats[STAT_NUM_GPIO_NOTIFICATIONS] += 1
+                    if mqtt_message is None:
+                        log.warning(
+                            "Main thread got notification of GPIO#%d being activated but there is NO CONFIGURATION for that pin. Ignoring.",
+                            gpio_number,
+                        )
+                        self.stats[STAT_ERROR_NOCONFIG] += 1
+                        continue
+
+                    mqtt_topic, mqtt_payload, mqtt_payload_bytes, debounce_sec = mqtt_message
+                    now_sec = loop.time()
+                    if now_sec - last_published_sec_by_gpio.get(gpio_number, float("-inf")) < debounce_sec:
+                        # this activation is part of a burst: the MQTT message has already been published
+                        self.stats[STAT_NUM_DEBOUNCED_NOTIFICATIONS] += 1
+                        continue
+                    last_published_sec_by_gpio[gpio_number] = now_sec
+
+                    log.debug(
+                        "Main thread got notification of GPIO#%d being activated; a valid MQTT configuration is attached: topic=%s, payload=%s",
+                        gpio_number,
+                        mqtt_topic,
+                        mqtt_payload,
+                    )
+                    publish_coroutines.append(client.publish(mqtt_topic, mqtt_payload_bytes, qos=MqttQOS.AT_LEAST_ONCE))
+
+                # send to broker
+                await asyncio.gather(*publish_coroutines)
+                self.stats[STAT_NUM_MQTT_MESSAGES] += len(publish_coroutines)
+        except aiomqtt.MqttError:
+            self.stats[STAT_ERROR_NUM_CONNECTIONS_LOST] += 1
+            raise
+        except Exception as err:
+            log.error(f"EXCEPTION: {err}")
+            sys.exit(99)
+
+    def print_stats(self, file=None):
+        print(">> GPIO INPUTS:", file=file)
+        print(
+            f">>   Num (re)connections to the MQTT broker [publish channel]: {self.stats[STAT_NUM_CONNECTIONS_PUBLISH]}",
+            file=file,
+        )
+        print(f">>   Num GPIO activations detected: {self.stats[STAT_NUM_GPIO_NOTIFICATIONS]}", file=file)
+        print(f">>   Num GPIO activations debounced: {self.stats[STAT_NUM_DEBOUNCED_NOTIFICATIONS]}", file=file)
+        print(f">>   Num MQTT messages published to the broker: {self.stats[STAT_NUM_MQTT_MESSAGES]}", file=file)
         print(
-            f"Connecting to MQTT broker with identifier {GpioInputsHandler.client_identifier} to publish GPIO INPUT states"
+            f">>   ERROR: GPIO inputs detected but missing configuration: {self.stats[STAT_ERROR_NOCONFIG]}", file=file
         )
-        self.stats["num_connections_publish"] += 1
-        while True:
-            try:
-                async with cfg.create_aiomqtt_client(GpioInputsHandler.client_identifier) as client:
-                    while not GpioInputsHandler.stop_requested:
-                        # get next notification coming from the gpiozero secondary thread:
-                        try:
-                            gpio_number = self.gpio_queue.get_nowait()
-                        except queue.Empty:
-                            # if there's no notification (typical case), then do not block the event loop
-                            # and keep processing other tasks... to ensure low-latency in processing the
-                            # GPIO inputs the sleep time is set equal to the MQTT publish freq
-                            await asyncio.sleep(cfg.homeassistant_publish_period_sec)
-                            continue
-
-                        # there is a GPIO notification to process:
-                        gpio_config = cfg.get_gpio_input_config(gpio_number)
-                        self.stats["num_gpio_notifications"] += 1
-                        if gpio_config is None or "mqtt" not in gpio_config:
-                            print(
-                                f"Main thread got notification of GPIO#{gpio_number} being activated but there is NO CONFIGURATION for that pin. Ignoring."
-                            )
-                            self.stats["ERROR_noconfig"] += 1
-                        else:
-                            # extract MQTT config
-                            mqtt_topic = gpio_config["mqtt"]["topic"]
-                            mqtt_payload = gpio_config["mqtt"]["payload"]
-                            print(
-                                f"Main thread got notification of GPIO#{gpio_number} being activated; a valid MQTT configuration is attached: topic={mqtt_topic}, payload={mqtt_payload}"
-                            )
-
-                            # send to broker
-                            await client.publish(mqtt_topic, mqtt_payload, qos=MqttQOS.AT_LEAST_ONCE)
-                            self.stats["num_mqtt_messages"] += 1
-
-                        self.gpio_queue.task_done()
-            except aiomqtt.MqttError as err:
-                print(f"Connection lost: {err}; reconnecting in {cfg.mqtt_reconnection_period_sec} seconds ...")
-                self.stats["ERROR_num_connections_lost"] += 1
-                await asyncio.sleep(cfg.mqtt_reconnection_period_sec)
-            except Exception as err:
-                print(f"EXCEPTION: {err}")
-                sys.exit(99)
-
-    def print_stats(self):
-        print(">> GPIO INPUTS:")
-        print(f">>   Num (re)connections to the MQTT broker [publish channel]: {self.stats['num_connections_publish']}")
-        print(f">>   Num GPIO activations detected: {self.stats['num_gpio_notifications']}")
-        print(f">>   Num MQTT messages published to the broker: {self.stats['num_mqtt_messages']}")
-        print(f">>   ERROR: GPIO inputs detected but missing configuration: {self.stats['ERROR_noconfig']}")
-        print(f">>   ERROR: MQTT connections lost: {self.stats['ERROR_num_connections_lost']}")
+        print(f">>   ERROR: MQTT connections lost: {self.stats[STAT_ERROR_NUM_CONNECTIONS_LOST]}", file=file)
@@ -1,8 +1,11 @@
 #!/usr/bin/env python3
 
+import array
 import gpiozero
 import asyncio
+import functools
 import json
+import logging
 import sys
 import aiomqtt
 from raspy2mqtt.constants import MqttQOS, MiscAppDefaults, HomeAssistantDefaults
@@ -14,6 +17,19 @@ from raspy2mqtt.config import AppConfig
 # License: Apache license
 #
 
+log = logging.getLogger(__name__)
+
+# indexes of the counters inside the stats array
+STAT_NUM_CONNECTIONS_SUBSCRIBE = 0
+STAT_NUM_MQTT_COMMANDS_PROCESSED = 1
+STAT_NUM_CONNECTIONS_PUBLISH = 2
+STAT_NUM_MQTT_STATES_PUBLISHED = 3
+STAT_NUM_CONNECTIONS_DISCOVERY_PUBLISH = 4
+STAT_NUM_MQTT_DISCOVERY_MESSAGES_PUBLISHED = 5
+STAT_ERROR_INVALID_PAYLOAD_RECEIVED = 6
+STAT_ERROR_NUM_CONNECTIONS_LOST = 7
+NUM_STATS = 8
+
 # =======================================================================================================
 # DummyOutputCh
 # =======================================================================================================
@@ -30,7 +46,7 @@ class DummyOutputCh:
         self.gpio = gpio
 
     def on(self):
-        print(
+        log.info(
             f"INTEGRATION-TEST-HELPER: DummyOutputCh: ON method invoked... writing into {MiscAppDefaults.INTEGRATION_TESTS_OUTPUT_FILE}"
         )
         self.is_lit = True
@@ -38,7 +54,7 @@ class DummyOutputCh:
             opened_file.write(f"{self.gpio}: ON")
 
     def off(self):
-        print(
+        log.info(
             f"INTEGRATION-TEST-HELPER: DummyOutputCh: OFF method invoked... writing into {MiscAppDefaults.INTEGRATION_TESTS_OUTPUT_FILE}"
         )
         self.is_lit = False
@@ -61,159 +77,214 @@ class GpioOutputsHandler:
     # the stop-request is not related to a particular instance of this class... it applies to any instance
     stop_requested = False
 
-    # the MQTT client identifiers
-    client_identifier_pub = "_outputs_state_publisher"
-    client_identifier_sub = "_outputs_cmd_subscriber"
+    # the stats counters which keep increasing even when nothing happens (e.g. because of periodic publishing)
+    periodic_stats = (STAT_NUM_MQTT_STATES_PUBLISHED,)
+
+    # the MQTT client identifier
     client_identifier_discovery_pub = "_outputs_discovery_publisher"
 
     def __init__(self):
         # global dictionary of gpiozero.LED instances used to drive outputs; key=MQTT topic
         self.output_channels = {}
 
-        self.stats = {
-            "num_connections_subscribe": 0,
-            "num_mqtt_commands_processed": 0,
-            "num_connections_publish": 0,
-            "num_mqtt_states_published": 0,
-            "num_connections_discovery_publish": 0,
-            "num_mqtt_discovery_messages_published": 0,
-            "ERROR_invalid_payload_received": 0,
-            "ERROR_num_connections_lost": 0,
-        }
+        # the state of all output channels, tracked as a bitmap updated whenever an output gets turned on/off:
+        # the i-th bit is associated with the i-th entry of the 'outputs' list in the configuration
+        self.output_status = 0
+
+        # counters for this handler, indexed by the STAT_* constants
+        self.stats = array.array("Q", [0] * NUM_STATS)
 
     def init_hardware(self, cfg: AppConfig) -> None:
         if cfg.disable_hw:
             # populate with dummies the output channels:
-            print("Skipping GPIO outputs HW initialization (--disable-hw was given)")
+            log.info("Skipping GPIO outputs HW initialization (--disable-hw was given)")
             for output_ch in cfg.get_all_outputs():
                 topic_name = output_ch["mqtt"]["topic"]
                 self.output_channels[topic_name] = DummyOutputCh(output_ch["gpio"])
         else:
             # setup GPIO pins for the OUTPUTs
-            print("Initializing GPIO output pins")
+            log.info("Initializing GPIO output pins")
             for output_ch in cfg.get_all_outputs():
                 topic_name = output_ch["mqtt"]["topic"]
                 active_high = not bool(output_ch["active_low"])
                 self.output_channels[topic_name] = gpiozero.LED(pin=output_ch["gpio"], active_high=active_high)
 
-    async def subscribe_and_activate_outputs(self, cfg: AppConfig):
+    def turn_on(self, output_channel, bit: int) -> None:
+        output_channel.on()
+        self.output_status |= bit
+
+    def turn_off(self, output_channel, bit: int) -> None:
+        output_channel.off()
+        self.output_status &= ~bit
+
+    def sync_output_status(self, cfg: AppConfig) -> None:
+        """
+        Rebuilds the 'output_status' bitmap from the actual state of the output channels.
+        """
+        output_status = 0
+        for i, output_ch in enumerate(cfg.get_all_outputs()):
+            if self.output_channels[output_ch["mqtt"]["topic"]].is_lit:
+                output_status |= 1 << i
+        self.output_status = output_status
+
+    def press_button(self, output_channel, bit: int) -> None:
+        """
+        Emulates the momentary press of a button: the output channel is turned on and it gets automatically
+        turned off after a short time, without blocking the processing of other MQTT commands.
+        """
+        self.turn_on(output_channel, bit)
+        asyncio.get_running_loop().call_later(
+            HomeAssistantDefaults.BUTTON_MOMENTARY_PRESS_SEC, self.turn_off, output_channel, bit
+        )
+
+    async def subscribe_and_activate_outputs(self, cfg: AppConfig, client: aiomqtt.Client):
         """
         Subscribes to MQTT topics that will receive commands to activate/turn-off GPIO outputs
         and takes care of interfacing with gpiozero to actually drive the GPIO output pin high or low.
+        The MQTT 'client' is shared with other coroutines: in case the connection to the broker gets lost,
+        the aiomqtt.MqttError is propagated to the caller, which takes care of reconnecting.
         """
-        print(
-            f"Connecting to MQTT broker with identifier {GpioOutputsHandler.client_identifier_sub} to subscribe to OUTPUT commands"
-        )
-        self.stats["num_connections_subscribe"] += 1
-        while True:
-            try:
-                async with cfg.create_aiomqtt_client(GpioOutputsHandler.client_identifier_sub) as client:
-                    for output_ch in cfg.get_all_outputs():
-                        topic = output_ch["mqtt"]["topic"]
-                        print(f"GpioOutputsHandler: Subscribing to topic [{topic}]")
-                        await client.subscribe(topic)
-
-                    async for message in client.messages:
-                        # IMPORTANT: the message.payload and message.topic are not strings and would fail
-                        #            a direct comparison to strings... so convert them explicitly to strings first:
-                        mqtt_topic = str(message.topic)
-                        mqtt_payload = message.payload.decode("UTF-8")
-
-                        output_ch = cfg.get_output_config_by_mqtt_topic(mqtt_topic)
-                        assert (
-                            output_ch is not None
-                        )  # this is garantueed because we subscribed only to topics that are present in config
-
-                        output_name = output_ch["name"]
-                        if mqtt_payload == output_ch["mqtt"]["payload_on"]:
-
-                            if output_ch["home_assistant"]["platform"] == "switch":
-                                print(
-                                    f"Received message for SWITCH digital output [{output_name}] from topic [{mqtt_topic}] with payload {mqtt_payload}... changing GPIO output pin state"
-                                )
-                                self.output_channels[mqtt_topic].on()
-                            elif output_ch["home_assistant"]["platform"] == "button":
-                                print(
-                                    f"Received message for BUTTON digital output [{output_name}] from topic [{mqtt_topic}] with payload {mqtt_payload}... changing GPIO output pin state for {HomeAssistantDefaults.BUTTON_MOMENTARY_PRESS_SEC}sec"
-                                )
-                                self.output_channels[mqtt_topic].on()
-                                await asyncio.sleep(HomeAssistantDefaults.BUTTON_MOMENTARY_PRESS_SEC)
-                                self.output_channels[mqtt_topic].off()
-
-                        elif mqtt_payload == output_ch["mqtt"]["payload_off"]:
-                            print(
-                                f"Received message for SWITCH digital output [{output_name}] from topic [{mqtt_topic}] with payload {mqtt_payload}... changing GPIO output pin state"
-                            )
-                            self.output_channels[mqtt_topic].off()
-                        else:
-                            print(
-                                f"Unrecognized payload received for digital output [{output_name}] from topic [{mqtt_topic}]: {mqtt_payload}"
-                            )
-                            self.stats["ERROR_invalid_payload_received"] += 1
-
-                        self.stats["num_mqtt_commands_processed"] += 1
-            except aiomqtt.MqttError as err:
-                print(f"Connection lost: {err}; reconnecting in {cfg.mqtt_reconnection_period_sec} seconds ...")
-                self.stats["ERROR_num_connections_lost"] += 1
-                await asyncio.sleep(cfg.mqtt_reconnection_period_sec)
-            except Exception as err:
-                print(f"EXCEPTION: {err}")
-                sys.exit(99)
-
-    async def publish_outputs_state(self, cfg: AppConfig):
+        self.stats[STAT_NUM_CONNECTIONS_SUBSCRIBE] += 1
+        try:
+            # map each subscribed topic to its output configuration and to a dispatch table associating each
+            # accepted (already encoded) payload with the action to perform, so that each incoming message costs
+            # just a couple of dict lookups:
+            commands_by_topic = {}
+            for i, output_ch in enumerate(cfg.get_all_outputs()):
+                topic = output_ch["mqtt"]["topic"]
+                output_channel = self.output_channels[topic]
+                if output_ch["home_assistant"]["platform"] == "button":
+                    on_action = functools.partial(self.press_button, output_channel, 1 << i)
+                else:
+                    on_action = functools.partial(self.turn_on, output_channel, 1 << i)
+                commands_by_topic[topic] = (
+                    output_ch,
+                    {
+                        output_ch["mqtt"]["payload_on"].encode("UTF-8"): on_action,
+                        output_ch["mqtt"]["payload_off"].encode("UTF-8"): functools.partial(
+                            self.turn_off, output_channel, 1 << i
+                        ),
+                    },
+                )
+                log.info(f"GpioOutputsHandler: Subscribing to topic [{topic}]")
+
+            # subscribe to all topics at once: a single SUBSCRIBE packet can carry all topic filters
+            if commands_by_topic:
+                await client.subscribe([(topic, MqttQOS.AT_LEAST_ONCE) for topic in commands_by_topic])
+
+            async for message in client.messages:
+                # IMPORTANT: the message.topic is an aiomqtt.Topic instance and message.payload is a
+                #            bytes object: use the string already stored inside the Topic and compare the
+                #            payload against the encoded payloads of the dispatch table:
+                mqtt_topic = message.topic.value
+                command = commands_by_topic.get(mqtt_topic)
+                assert (
+                    command is not None
+                )  # this is garantueed because we subscribed only to topics that are present in config
+
+                output_ch, actions = command
+                action = actions.get(message.payload)
+                if action is not None:
+                    log.debug(
+                        "Received message for %s digital output [%s] from topic [%s] with payload %s... changing GPIO output pin state",
+                        output_ch["home_assistant"]["platform"].upper(),
+                        output_ch["name"],
+                        mqtt_topic,
+                        message.payload,
+                    )
+                    action()
+                else:
+                    log.warning(
+                        "Unrecognized payload received for digital output [%s] from topic [%s]: %s",
+                        output_ch["name"],
+                        mqtt_topic,
+                        message.payload,
+                    )
+                    self.stats[STAT_ERROR_INVALID_PAYLOAD_RECEIVED] += 1
+
+                self.stats[STAT_NUM_MQTT_COMMANDS_PROCESSED] += 1
+        except aiomqtt.MqttError:
+            self.stats[STAT_ERROR_NUM_CONNECTIONS_LOST] += 1
+            raise
+        except Exception as err:
+            log.error(f"EXCEPTION: {err}")
+            sys.exit(99)
+
+    async def publish_outputs_state(self, cfg: AppConfig, client: aiomqtt.Client):
         """
         For each output GPIO pin this function publishes over MQTT the 'state topic'.
         The 'state topic' is a HomeAssistant-thing that acts as confirmation of the output commands:
         only when the output truly can change from OFF->ON or from ON->OFF the state topic gets updated.
+        The MQTT 'client' is shared with other coroutines: in case the connection to the broker gets lost,
+        the aiomqtt.MqttError is propagated to the caller, which takes care of reconnecting.
 
         This function can be gracefully stopped by setting the
          GpioOutputsHandler.stop_requested
         class variable to true.
         """
-
-        print(
-            f"Connecting to MQTT broker with identifier {GpioOutputsHandler.client_identifier_pub} to publish GPIO OUTPUT states"
-        )
-        self.stats["num_connections_publish"] += 1
-        output_status_map = {}
-        while True:
-            try:
-                async with cfg.create_aiomqtt_client(GpioOutputsHandler.client_identifier_pub) as client:
-                    while not GpioOutputsHandler.stop_requested:
-                        for output_ch in cfg.get_all_outputs():
-                            mqtt_topic = output_ch["mqtt"]["topic"]
-                            mqtt_state_topic = output_ch["mqtt"]["state_topic"]
-                            assert mqtt_topic in self.output_channels  # this should be garantueed due to initial setup
-                            output_status = self.output_channels[mqtt_topic].is_lit
-
-                            if mqtt_topic not in output_status_map or output_status_map[mqtt_topic] != output_status:
-                                # need to publish an update over MQTT... the state has changed
-                                mqtt_payload = (
-                                    output_ch["mqtt"]["payload_on"]
-                                    if output_status
-                                    else output_ch["mqtt"]["payload_off"]
-                                )
-
-                                # publish with RETAIN flag so that Home Assistant will always find an updated status on
-                                # the broker about each switch/button
-                                print(f"Publishing to topic {mqtt_state_topic} the payload {mqtt_payload}")
-                                await client.publish(
-                                    mqtt_state_topic, mqtt_payload, qos=MqttQOS.AT_LEAST_ONCE, retain=True
-                                )
-                                self.stats["num_mqtt_states_published"] += 1
-
-                                # remember the status we just published in order to later skip meaningless updates
-                                # when there is no state change:
-                                output_status_map[mqtt_topic] = output_status
-
-                        await asyncio.sleep(cfg.homeassistant_publish_period_sec)
-            except aiomqtt.MqttError as err:
-                print(f"Connection lost: {err}; reconnecting in {cfg.mqtt_reconnection_period_sec} seconds ...")
-                self.stats["ERROR_num_connections_lost"] += 1
-                await asyncio.sleep(cfg.mqtt_reconnection_period_sec)
-            except Exception as err:
-                print(f"EXCEPTION: {err}")
-                sys.exit(99)
+        self.stats[STAT_NUM_CONNECTIONS_PUBLISH] += 1
+
+        # the i-th entry of this list is associated with the i-th bit of the 'output_status' bitmap;
+        # the state payloads are encoded once here instead of at every publish
+        outputs = []
+        for output_ch in cfg.get_all_outputs():
+            assert output_ch["mqtt"]["topic"] in self.output_channels  # this should be garantueed due to initial setup
+            outputs.append(
+                (
+                    output_ch["mqtt"]["state_topic"],
+                    output_ch["mqtt"]["payload_on"].encode("UTF-8"),
+                    output_ch["mqtt"]["payload_off"].encode("UTF-8"),
+                )
+            )
+
+        # on a new connection re-sync the bitmap with the state of the output channels, so that the first publish
+        # reflects the true state of the GPIO pins even if it drifted from the bitmap while disconnected:
+        self.sync_output_status(cfg)
+
+        # remember the status we published in order to later skip meaningless updates when there is no state change;
+        # the 'published_mask' bitmap tracks which outputs had their state published at least once on this connection
+        published_status = 0
+        published_mask = 0
+        all_outputs_mask = (1 << len(outputs)) - 1
+        publish_period_sec = cfg.homeassistant_publish_period_sec
+        try:
+            while not GpioOutputsHandler.stop_requested:
+                # the output status is updated by turn_on()/turn_off(): no need to query the GPIO pins
+                output_status = self.output_status
+
+                # need to publish an update over MQTT only for the outputs whose state has changed:
+                changed = (output_status ^ published_status) | (all_outputs_mask & ~published_mask)
+                publish_coroutines = []
+                while changed:
+                    # extract the lowest bit set in the 'changed' bitmap:
+                    bit = changed & -changed
+                    changed ^= bit
+                    state_topic, payload_on, payload_off = outputs[bit.bit_length() - 1]
+                    mqtt_payload = payload_on if output_status & bit else payload_off
+
+                    # publish with RETAIN flag so that Home Assistant will always find an updated status on
+                    # the broker about each switch/button; QoS 0 is enough since a state update can get lost only
+                    # together with the connection, and all states are published again on the new connection
+                    log.debug("Publishing to topic %s the payload %s", state_topic, mqtt_payload)
+                    publish_coroutines.append(
+                        client.publish(state_topic, mqtt_payload, qos=MqttQOS.AT_MOST_ONCE, retain=True)
+                    )
+
+                # send all state updates to the broker back-to-back
+                await asyncio.gather(*publish_coroutines)
+                self.stats[STAT_NUM_MQTT_STATES_PUBLISHED] += len(publish_coroutines)
+
+                # now the broker is aware of the current state of all outputs:
+                published_status = output_status
+                published_mask = all_outputs_mask
+
+                await asyncio.sleep(publish_period_sec)
+        except aiomqtt.MqttError:
+            self.stats[STAT_ERROR_NUM_CONNECTIONS_LOST] += 1
+            raise
+        except Exception as err:
+            log.error(f"EXCEPTION: {err}")
+            sys.exit(99)
 
     async def homeassistant_discovery_message_publish(self, cfg: AppConfig):
         """
@@ -221,18 +292,20 @@ class GpioOutputsHandler:
         detect the binary_sensors associated with the GPIO inputs.
         See https://www.home-assistant.io/integrations/mqtt/#mqtt-discovery
         """
-        print(
+        log.info(
             f"Connecting to MQTT broker with identifier {GpioOutputsHandler.client_identifier_discovery_pub} to publish OUTPUT discovery messages"
         )
-        self.stats["num_connections_discovery_publish"] += 1
+        self.stats[STAT_NUM_CONNECTIONS_DISCOVERY_PUBLISH] += 1
 
         try:
             async with cfg.create_aiomqtt_client(GpioOutputsHandler.client_identifier_discovery_pub) as client:
-                print("Publishing DISCOVERY messages for GPIO OUTPUTs")
+                log.info("Publishing DISCOVERY messages for GPIO OUTPUTs")
+                # these are the same for all entries:
+                mqtt_prefix = cfg.homeassistant_discovery_topic_prefix
+                mqtt_node_id = cfg.homeassistant_discovery_topic_node_id
+                device_dict = cfg.get_device_dict()
                 for entry in cfg.get_all_outputs():
-                    mqtt_prefix = cfg.homeassistant_discovery_topic_prefix
                     mqtt_platform = entry["home_assistant"]["platform"]
-                    mqtt_node_id = cfg.homeassistant_discovery_topic_node_id
                     mqtt_discovery_topic = f"{mqtt_prefix}/{mqtt_platform}/{mqtt_node_id}/{entry['name']}/config"
 
                     # NOTE: the HomeAssistant unique_id is what appears in the config file as "name"
@@ -243,7 +316,7 @@ class GpioOutputsHandler:
                         "state_topic": entry["mqtt"]["state_topic"],
                         "device_class": entry["home_assistant"]["device_class"],
                         # "expire_after": entry['home_assistant']["expire_after"], -- not supported by MQTT switch :(
-                        "device": cfg.get_device_dict(),
+                        "device": device_dict,
                     }
                     if entry["home_assistant"]["icon"] is not None:
                         # add icon to the config of the entry:
@@ -257,32 +330,45 @@ class GpioOutputsHandler:
 
                     mqtt_payload = json.dumps(mqtt_payload_dict)
                     await client.publish(mqtt_discovery_topic, mqtt_payload, qos=MqttQOS.AT_LEAST_ONCE)
-                    self.stats["num_mqtt_discovery_messages_published"] += 1
+                    self.stats[STAT_NUM_MQTT_DISCOVERY_MESSAGES_PUBLISHED] += 1
 
         except aiomqtt.MqttError as err:
-            print(f"Connection lost: {err}; reconnecting in {cfg.mqtt_reconnection_period_sec} seconds ...")
-            self.stats["ERROR_num_connections_lost"] += 1
+            log.warning(f"Connection lost: {err}; reconnecting in {cfg.mqtt_reconnection_period_sec} seconds ...")
+            self.stats[STAT_ERROR_NUM_CONNECTIONS_LOST] += 1
             await asyncio.sleep(cfg.mqtt_reconnection_period_sec)
         except Exception as err:
-            print(f"EXCEPTION: {err}")
+            log.error(f"EXCEPTION: {err}")
             sys.exit(99)
 
-    def print_stats(self):
-        print(">> OUTPUTS:")
+    def print_stats(self, file=None):
+        print(">> OUTPUTS:", file=file)
+        print(
+            f">>   Num (re)connections to the MQTT broker [subscribe channel]: {self.stats[STAT_NUM_CONNECTIONS_SUBSCRIBE]}",
+            file=file,
+        )
+        print(
+            f">>   Num commands for output channels processed from MQTT broker: {self.stats[STAT_NUM_MQTT_COMMANDS_PROCESSED]}",
+            file=file,
+        )
+        print(
+            f">>   Num (re)connections to the MQTT broker [publish channel]: {self.stats[STAT_NUM_CONNECTIONS_PUBLISH]}",
+            file=file,
+        )
         print(
-            f">>   Num (re)connections to the MQTT broker [subscribe channel]: {self.stats['num_connections_subscribe']}"
+            f">>   Num states for output channels published on the MQTT broker: {self.stats[STAT_NUM_MQTT_STATES_PUBLISHED]}",
+            file=file,
         )
+        print(">>   OUTPUTs DISCOVERY messages:", file=file)
         print(
-            f">>   Num commands for output channels processed from MQTT broker: {self.stats['num_mqtt_commands_processed']}"
+            f">>     Num MQTT discovery messages published: {self.stats[STAT_NUM_MQTT_DISCOVERY_MESSAGES_PUBLISHED]}",
+            file=file,
         )
-        print(f">>   Num (re)connections to the MQTT broker [publish channel]: {self.stats['num_connections_publish']}")
         print(
-            f">>   Num states for output channels published on the MQTT broker: {self.stats['num_mqtt_states_published']}"
+            f">>     Num (re)connections to the MQTT broker: {self.stats[STAT_NUM_CONNECTIONS_DISCOVERY_PUBLISH]}",
+            file=file,
         )
-        print(">>   OUTPUTs DISCOVERY messages:")
-        print(f">>     Num MQTT discovery messages published: {self.stats['num_mqtt_discovery_messages_published']}")
-        print(f">>     Num (re)connections to the MQTT broker: {self.stats['num_connections_discovery_publish']}")
         print(
-            f">>   ERROR: invalid payloads received [subscribe channel]: {self.stats['ERROR_invalid_payload_received']}"
+            f">>   ERROR: invalid payloads received [subscribe channel]: {self.stats[STAT_ERROR_INVALID_PAYLOAD_RECEIVED]}",
+            file=file,
         )
-        print(f">>   ERROR: MQTT connections lost: {self.stats['ERROR_num_connections_lost']}")
+        print(f">>   ERROR: MQTT connections lost: {self.stats[STAT_ERROR_NUM_CONNECTIONS_LOST]}", file=file)
@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 
+import array
 import asyncio
+import logging
 import sys
 import aiomqtt
 from raspy2mqtt.config import AppConfig
@@ -12,6 +14,14 @@ from raspy2mqtt.config import AppConfig
 # License: Apache license
 #
 
+log = logging.getLogger(__name__)
+
+# indexes of the counters inside the stats array
+STAT_NUM_CONNECTIONS_SUBSCRIBE = 0
+STAT_NUM_MQTT_STATUS_MSG_PROCESSED = 1
+STAT_ERROR_NUM_CONNECTIONS_LOST = 2
+NUM_STATS = 3
+
 # =======================================================================================================
 # HomeAssistantStatusTracker
 # =======================================================================================================
@@ -27,16 +37,16 @@ class HomeAssistantStatusTracker:
     # the stop-request is not related to a particular instance of this class... it applies to any instance
     stop_requested = False
 
+    # the stats counters which keep increasing even when nothing happens (e.g. because of periodic publishing)
+    periodic_stats = ()
+
     # the MQTT client identifier
     client_identifier = "_homeassistant_status_tracker"
 
     def __init__(self):
         self.coroutines_list = []
-        self.stats = {
-            "num_connections_subscribe": 0,
-            "num_mqtt_status_msg_processed": 0,
-            "ERROR_num_connections_lost": 0,
-        }
+        # counters for this handler, indexed by the STAT_* constants
+        self.stats = array.array("Q", [0] * NUM_STATS)
 
     def set_discovery_publish_coroutines(self, coroutines_list):
         self.coroutines_list = coroutines_list
@@ -44,7 +54,7 @@ class HomeAssistantStatusTracker:
     async def trigger_discovery_messages(self, cfg: AppConfig):
         idx = 1
         for coro in self.coroutines_list:
-            print(f"Launching MQTT discovery message generator coroutine #{idx}...")
+            log.info(f"Launching MQTT discovery message generator coroutine #{idx}...")
             await coro(cfg)
             idx += 1
 
@@ -52,10 +62,10 @@ class HomeAssistantStatusTracker:
         """
         Subscribes to the MQTT topic used by HomeAssistant to signal that it has restarted.
         """
-        print(
+        log.info(
             f"Connecting to MQTT broker with identifier {HomeAssistantStatusTracker.client_identifier} to subscribe to HOME ASSISTANT status topic"
         )
-        self.stats["num_connections_subscribe"] += 1
+        self.stats[STAT_NUM_CONNECTIONS_SUBSCRIBE] += 1
         while True:
             try:
                 async with cfg.create_aiomqtt_client(HomeAssistantStatusTracker.client_identifier) as client:
@@ -66,35 +76,35 @@ class HomeAssistantStatusTracker:
 
                     # subscribe
                     topic = f"{cfg.homeassistant_discovery_topic_prefix}/status"
-                    print(f"HomeAssistantStatusTracker: Subscribing to topic [{topic}]")
+                    log.info(f"HomeAssistantStatusTracker: Subscribing to topic [{topic}]")
                     await client.subscribe(topic)
 
                     async for message in client.messages:
-                        # IMPORTANT: the message.payload and message.topic are not strings and would fail
-                        #            a direct comparison to strings... so convert them explicitly to strings first:
-                        # mqtt_topic = str(message.topic)
+                        # IMPORTANT: the message.payload is not a string and would fail
+                        #            a direct comparison to strings... so convert it explicitly to string first:
                         mqtt_payload = message.payload.decode("UTF-8")
 
-                        self.stats["num_mqtt_status_msg_processed"] += 1
+                        self.stats[STAT_NUM_MQTT_STATUS_MSG_PROCESSED] += 1
                         if mqtt_payload == "online":
-                            print("HomeAssistant status changed to 'online'. Sending MQTT discovery messages.")
+                            log.info("HomeAssistant status changed to 'online'. Sending MQTT discovery messages.")
                             await self.trigger_discovery_messages(cfg)
                         elif mqtt_payload == "offline":
                             # this is typically not a good news, unless it's a planned maintainance
-                            print("!!! HomeAssistant status changed to 'offline' !!!")
+                            log.warning("!!! HomeAssistant status changed to 'offline' !!!")
 
             except aiomqtt.MqttError as err:
-                print(f"Connection lost: {err}; reconnecting in {cfg.mqtt_reconnection_period_sec} seconds ...")
-                self.stats["ERROR_num_connections_lost"] += 1
+                log.warning(f"Connection lost: {err}; reconnecting in {cfg.mqtt_reconnection_period_sec} seconds ...")
+                self.stats[STAT_ERROR_NUM_CONNECTIONS_LOST] += 1
                 await asyncio.sleep(cfg.mqtt_reconnection_period_sec)
             except Exception as err:
-                print(f"EXCEPTION: {err}")
+                log.error(f"EXCEPTION: {err}")
                 sys.exit(99)
 
-    def print_stats(self):
-        print(">> HOME ASSISTANT STATUS TRACKER:")
+    def print_stats(self, file=None):
+        print(">> HOME ASSISTANT STATUS TRACKER:", file=file)
         print(
-            f">>   Num (re)connections to the MQTT broker [subscribe channel]: {self.stats['num_connections_subscribe']}"
+            f">>   Num (re)connections to the MQTT broker [subscribe channel]: {self.stats[STAT_NUM_CONNECTIONS_SUBSCRIBE]}",
+            file=file,
         )
-        print(f">>   Num MQTT status messages processed: {self.stats['num_mqtt_status_msg_processed']}")
-        print(f">>   ERROR: MQTT connections lost: {self.stats['ERROR_num_connections_lost']}")
+        print(f">>   Num MQTT status messages processed: {self.stats[STAT_NUM_MQTT_STATUS_MSG_PROCESSED]}", file=file)
+        print(f">>   ERROR: MQTT connections lost: {self.stats[STAT_ERROR_NUM_CONNECTIONS_LOST]}", file=file)
@@ -1,12 +1,17 @@
 #!/usr/bin/env python3
 
+import array
 import lib16inpind
-import time
+import smbus2
 import asyncio
 import gpiozero
 import json
+import logging
 import sys
+import threading
 import aiomqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
 from raspy2mqtt.constants import MqttQOS, SeqMicroHatConstants
 from raspy2mqtt.config import AppConfig
 
@@ -17,6 +22,21 @@ from raspy2mqtt.config import AppConfig
 # License: Apache license
 #
 
+log = logging.getLogger(__name__)
+
+# indexes of the counters inside the stats array
+STAT_NUM_READINGS = 0
+STAT_NUM_CONNECTIONS_PUBLISH = 1
+STAT_NUM_MQTT_MESSAGES = 2
+STAT_NUM_CONNECTIONS_DISCOVERY_PUBLISH = 3
+STAT_NUM_MQTT_DISCOVERY_MESSAGES_PUBLISHED = 4
+STAT_ERROR_NUM_CONNECTIONS_LOST = 5
+STAT_NUM_NOOP_READINGS = 6
+NUM_STATS = 7
+
+# lookup table reversing the order of the bits in a byte
+_BIT_REVERSE_TABLE = bytes(int(f"{i:08b}"[::-1], 2) for i in range(256))
+
 # =======================================================================================================
 # OptoIsolatedInputsHandler
 # =======================================================================================================
@@ -33,44 +53,62 @@ class OptoIsolatedInputsHandler:
     # the stop-request is not related to a particular instance of this class... it applies to any instance
     stop_requested = False
 
+    # the stats counters which keep increasing even when nothing happens (e.g. because of periodic publishing)
+    periodic_stats = (STAT_NUM_READINGS, STAT_NUM_NOOP_READINGS, STAT_NUM_MQTT_MESSAGES)
+
     # the MQTT client identifier
-    client_identifier = "_optoisolated_publisher"
     client_identifier_discovery_pub = "_optoisolated_discovery_publisher"
 
     def __init__(self):
         # last reading of the 16 digital opto-isolated inputs
         self.optoisolated_inputs_sampled_values = 0
 
-        self.stats = {
-            "num_readings": 0,
-            "num_connections_publish": 0,
-            "num_mqtt_messages": 0,
-            "num_connections_discovery_publish": 0,
-            "num_mqtt_discovery_messages_published": 0,
-            "ERROR_num_connections_lost": 0,
-        }
+        # the inputs get sampled both by the gpiozero thread, when the interrupt line fires, and by an executor
+        # thread, as a periodic fallback: this lock serializes the I2C transactions on the shared SMBus handle
+        # (smbus2 is not thread-safe) together with the update of the sampled values and of the stats
+        self.sampling_lock = threading.Lock()
 
-    def init_hardware(self, cfg: AppConfig) -> list[gpiozero.Button]:
+        # event used to wake up the publishing coroutine as soon as the sampled values change;
+        # NOTE: asyncio.Event is not thread-safe, so it must be set using loop.call_soon_threadsafe()
+        self.sampled_values_changed = asyncio.Event()
+        self.loop = None
+
+        # the I2C bus connected to the HAT is opened once and kept open for all readings
+        self.i2c_bus = None
+        self.i2c_address = SeqMicroHatConstants.I2C_BASE_ADDRESS + (0x07 ^ SeqMicroHatConstants.STACK_LEVEL)
+
+        # counters for this handler, indexed by the STAT_* constants
+        self.stats = array.array("Q", [0] * NUM_STATS)
+
+    def init_hardware(self, cfg: AppConfig, loop: asyncio.BaseEventLoop) -> list[gpiozero.Button] | None:
+        """
+        Returns the list of gpiozero.Button instances which must be kept alive, or None in case
+        the opto-isolated input board could not be initialized.
+        """
         buttons = []
+        self.loop = loop
         if cfg.disable_hw:
-            print("Skipping optoisolated inputs HW initialization (--disable-hw was given)")
+            log.info("Skipping optoisolated inputs HW initialization (--disable-hw was given)")
         else:
             # check if the opto-isolated input board from Sequent Microsystem is indeed present:
             try:
                 _ = lib16inpind.readAll(SeqMicroHatConstants.STACK_LEVEL)
+                self.i2c_bus = smbus2.SMBus(SeqMicroHatConstants.I2C_BUS)
             except FileNotFoundError as e:
-                print(f"Could not read from the Sequent Microsystem opto-isolated input board: {e}. Aborting.")
-                return 2
+                log.error(f"Could not read from the Sequent Microsystem opto-isolated input board: {e}. Aborting.")
+                return None
             except OSError as e:
-                print(f"Error while reading from the Sequent Microsystem opto-isolated input board: {e}. Aborting.")
-                return 2
+                log.error(f"Error while reading from the Sequent Microsystem opto-isolated input board: {e}. Aborting.")
+                return None
             except BaseException as e:
-                print(f"Error while reading from the Sequent Microsystem opto-isolated input board: {e}. Aborting.")
-                return 2
+                log.error(f"Error while reading from the Sequent Microsystem opto-isolated input board: {e}. Aborting.")
+                return None
 
-            print("Initializing SequentMicrosystem GPIO interrupt line")
+            log.info("Initializing SequentMicrosystem GPIO interrupt line")
+            # the I/O expander pulls the interrupt line low as soon as any input changes, and releases it
+            # once the inputs get read: sample the inputs on the falling edge, without waiting any hold time
             b = gpiozero.Button(SeqMicroHatConstants.INTERRUPT_GPIO, pull_up=True)
-            b.when_held = self.sample_optoisolated_inputs
+            b.when_pressed = self.sample_optoisolated_inputs
             buttons.append(b)
 
             # do first sampling operation immediately:
@@ -81,87 +119,148 @@ class OptoIsolatedInputsHandler:
     def sample_optoisolated_inputs(self):
         """
         This function is invoked when the SequentMicrosystem hat triggers an interrupt saying
-        "hey there is some change in my inputs"... so we read all the 16 digital inputs
+        "hey there is some change in my inputs"... so we read all the 16 digital inputs.
+        It is also invoked periodically, as a fallback, before each periodic publish.
         """
 
-        # NOTE0: since this routine is invoked by the gpiozero library, it runs on a secondary OS thread
-        #        so _in theory_ we should be using a mutex when writing to the global 'optoisolated_inputs_sampled_values'
-        #        variable. In practice since it's a simple integer variable, I don't think the mutex is needed.
+        # NOTE0: this routine runs on a secondary OS thread (the gpiozero one or an executor one), possibly
+        #        concurrently on two threads: hence everything is done while holding the 'sampling_lock'
         # NOTE1: this is a blocking call that will block until the 16 inputs are sampled
         # NOTE2: this might raise a TimeoutError exception in case the I2C bus transaction fails
-        self.optoisolated_inputs_sampled_values = lib16inpind.readAll(SeqMicroHatConstants.STACK_LEVEL)
-        self.stats["num_readings"] += 1
-
-        # FIXME: right now, it's hard to force-wake the coroutine
-        # which handles publishing to MQTT
-        # the reason is that we should be using
-        #   https://docs.python.org/3/library/asyncio-sync.html#asyncio.Event
-        # which is not thread-safe. And this function executes in GPIOzero secondary thread :(
-        # This means that if an input changes rapidly from 0 to 1 and then back to 0, we might not
-        # publish this to MQTT (depends on the MQTT publish frequency... nyquist frequency)
-
-    async def publish_optoisolated_inputs(self, cfg: AppConfig):
+        # NOTE3: this is equivalent to lib16inpind.readAll() but it avoids opening/closing the I2C bus at each reading
+        #        and converts the raw register value with 2 table lookups instead of a loop over the 16 bits:
+        #        the inputs are active low and the 1st input is associated with the most significant bit
+        with self.sampling_lock:
+            raw_value = (
+                ~self.i2c_bus.read_word_data(self.i2c_address, SeqMicroHatConstants.I2C_INPUTS_REGISTER) & 0xFFFF
+            )
+            sampled_values = (_BIT_REVERSE_TABLE[raw_value & 0xFF] << 8) | _BIT_REVERSE_TABLE[raw_value >> 8]
+            self.stats[STAT_NUM_READINGS] += 1
+            if sampled_values == self.optoisolated_inputs_sampled_values:
+                # e.g. noise on the interrupt line: nothing changed since the last reading
+                self.stats[STAT_NUM_NOOP_READINGS] += 1
+                return
+            self.optoisolated_inputs_sampled_values = sampled_values
+
+        # wake up the coroutine which handles publishing to MQTT, so that the changed inputs get published
+        # immediately; since this function executes in GPIOzero secondary thread, ask the event loop
+        # (which runs in the main thread) to set the event on our behalf
+        self.loop.call_soon_threadsafe(self.sampled_values_changed.set)
+
+    async def publish_optoisolated_inputs(self, cfg: AppConfig, client: aiomqtt.Client):
         """
         Publishes over MQTT the status of all opto-isolated inputs.
         This function has a particularity: it's designed to continuously publish over MQTT the status of
         the input channels. This is a safety feature designed mostly for alarm systems: thanks to this continuous
         updates, the subscriber can trigger the burglar alarm if the stream of input sensor updates stops for some reason.
+        Besides such periodic publishing of all inputs, whenever the sampled values change, the inputs that changed
+        are published immediately.
+        All messages are retained by the broker, so that new subscribers get the last state without waiting
+        for the next periodic publish.
+        The MQTT 'client' is shared with other coroutines: in case the connection to the broker gets lost,
+        the aiomqtt.MqttError is propagated to the caller, which takes care of reconnecting.
         """
-        print(
-            f"Connecting to MQTT broker with identifier {OptoIsolatedInputsHandler.client_identifier} to publish OPTOISOLATED INPUT states"
-        )
-        self.stats["num_connections_publish"] += 1
-        while True:
-            try:
-                async with cfg.create_aiomqtt_client(OptoIsolatedInputsHandler.client_identifier) as client:
-                    while not OptoIsolatedInputsHandler.stop_requested:
-                        # Publish each sampled value as a separate MQTT topic
-                        update_loop_start_sec = time.perf_counter()
-                        for i in range(SeqMicroHatConstants.MAX_CHANNELS):
-
-                            # IMPORTANT: this function expects something else to update the 'optoisolated_inputs_sampled_values'
-                            #            integer, whenever it is necessary to update it
-
-                            # Extract the bit at position i-th using bitwise AND operation
-                            bit_value = bool(self.optoisolated_inputs_sampled_values & (1 << i))
-
-                            # convert from zero-based index 'i' to 1-based index, as used in the config file
-                            input_cfg = cfg.get_optoisolated_input_config(1 + i)
-                            if input_cfg is not None:
-                                if input_cfg["active_low"]:
-                                    logical_value = not bit_value
-                                    # input_type = "active low"
-                                else:
-                                    logical_value = bit_value
-                                    # input_type = "active high"
-
-                                payload = (
-                                    input_cfg["mqtt"]["payload_on"]
-                                    if logical_value
-                                    else input_cfg["mqtt"]["payload_off"]
-                                )
-                                # print(f"From INPUT#{i+1} [{input_type}] read {int(bit_value)} -> {int(logical_value)}; publishing on mqtt topic [{topic}] the payload: {payload}")
-
-                                await client.publish(input_cfg["mqtt"]["topic"], payload, qos=MqttQOS.AT_LEAST_ONCE)
-                                self.stats["num_mqtt_messages"] += 1
-
-                        update_loop_duration_sec = time.perf_counter() - update_loop_start_sec
-                        # print(f"Updating all sensors on MQTT took {update_loop_duration_sec} secs")
-
-                        # Now sleep a little bit before repeating
-                        actual_sleep_time_sec = cfg.homeassistant_publish_period_sec
-                        if actual_sleep_time_sec > update_loop_duration_sec:
-                            # adjust for the time it took to update on MQTT broker all topics
-                            actual_sleep_time_sec -= update_loop_duration_sec
-
-                        await asyncio.sleep(actual_sleep_time_sec)
-            except aiomqtt.MqttError as err:
-                print(f"Connection lost: {err}; reconnecting in {cfg.mqtt_reconnection_period_sec} seconds ...")
-                self.stats["ERROR_num_connections_lost"] += 1
-                await asyncio.sleep(cfg.mqtt_reconnection_period_sec)
-            except Exception as err:
-                print(f"EXCEPTION: {err}")
-                sys.exit(99)
+        self.stats[STAT_NUM_CONNECTIONS_PUBLISH] += 1
+
+        # resolve once the configuration of each input channel: the i-th entry of this table is associated with
+        # the i-th bit of the sampled values and contains the MQTT topic, the (already encoded) ON/OFF payloads
+        # and the MQTT v5 properties to publish with: a retained input state expires on the broker after the same
+        # time HomeAssistant uses to consider it stale ('expire_after'), unless expire_after=0 which disables expiry;
+        # the active-low flags are collected in a bitmask, so that a single XOR converts the sampled values into
+        # the logical values of all inputs
+        channels = [None] * SeqMicroHatConstants.MAX_CHANNELS
+        configured_mask = 0
+        active_low_mask = 0
+        for i in range(SeqMicroHatConstants.MAX_CHANNELS):
+            # convert from zero-based index 'i' to 1-based index, as used in the config file
+            input_cfg = cfg.get_optoisolated_input_config(1 + i)
+            if input_cfg is not None:
+                publish_properties = None
+                if input_cfg["home_assistant"]["expire_after"] > 0:
+                    publish_properties = Properties(PacketTypes.PUBLISH)
+                    publish_properties.MessageExpiryInterval = input_cfg["home_assistant"]["expire_after"]
+                channels[i] = (
+                    input_cfg["mqtt"]["topic"],
+                    input_cfg["mqtt"]["payload_on"].encode("UTF-8"),
+                    input_cfg["mqtt"]["payload_off"].encode("UTF-8"),
+                    publish_properties,
+                )
+                configured_mask |= 1 << i
+                if input_cfg["active_low"]:
+                    active_low_mask |= 1 << i
+
+        publish_period_sec = cfg.homeassistant_publish_period_sec
+        try:
+            # the sampled values published last time; the first time all inputs are published
+            published_values = None
+            next_periodic_publish_sec = self.loop.time()
+            # the number of readings done up to the last periodic publish
+            last_num_readings = -1
+            while not OptoIsolatedInputsHandler.stop_requested:
+                periodic_publish = self.loop.time() >= next_periodic_publish_sec
+                if periodic_publish and self.i2c_bus is not None and self.stats[STAT_NUM_READINGS] == last_num_readings:
+                    # fallback in case an edge on the interrupt line gets missed: if no reading happened during the
+                    # whole publish period, sample the inputs anyway before the periodic publish;
+                    # the I2C transaction is blocking, so run it in the default executor
+                    try:
+                        await self.loop.run_in_executor(None, self.sample_optoisolated_inputs)
+                    except OSError as e:
+                        log.warning(f"Error while reading from the Sequent Microsystem opto-isolated input board: {e}")
+                if periodic_publish:
+                    last_num_readings = self.stats[STAT_NUM_READINGS]
+                self.sampled_values_changed.clear()
+
+                # IMPORTANT: this function expects something else to update the 'optoisolated_inputs_sampled_values'
+                #            integer, whenever it is necessary to update it
+                sampled_values = self.optoisolated_inputs_sampled_values
+                if published_values is None:
+                    # first publish on this connection: all inputs are considered as changed
+                    changed_bits = configured_mask
+                else:
+                    changed_bits = (sampled_values ^ published_values) & configured_mask
+                if periodic_publish:
+                    # periodic publish: all inputs are published
+                    bits_to_publish = configured_mask
+                    next_periodic_publish_sec = self.loop.time() + publish_period_sec
+                else:
+                    # woken up by a change: publish only the inputs that changed
+                    bits_to_publish = changed_bits
+
+                # Publish each sampled value as a separate MQTT topic
+                logical_values = sampled_values ^ active_low_mask
+                publish_coroutines = []
+                while bits_to_publish:
+                    # extract the lowest bit set in the 'bits_to_publish' bitmap:
+                    bit = bits_to_publish & -bits_to_publish
+                    bits_to_publish ^= bit
+                    topic, payload_on, payload_off, publish_properties = channels[bit.bit_length() - 1]
+                    payload = payload_on if logical_values & bit else payload_off
+                    # state changes must be delivered, while the periodic re-publishing of unchanged states
+                    # can skip the PUBACK round-trip: a lost message gets superseded by the next one
+                    qos = MqttQOS.AT_LEAST_ONCE if changed_bits & bit else MqttQOS.AT_MOST_ONCE
+                    publish_coroutines.append(
+                        client.publish(topic, payload, qos=qos, retain=True, properties=publish_properties)
+                    )
+
+                # send all messages to the broker back-to-back, instead of waiting for each one to complete
+                await asyncio.gather(*publish_coroutines)
+                self.stats[STAT_NUM_MQTT_MESSAGES] += len(publish_coroutines)
+                published_values = sampled_values
+
+                # now sleep till the next periodic publish, unless the sampled values change in the meanwhile
+                try:
+                    await asyncio.wait_for(
+                        self.sampled_values_changed.wait(),
+                        timeout=max(0, next_periodic_publish_sec - self.loop.time()),
+                    )
+                except TimeoutError:
+                    pass
+        except aiomqtt.MqttError:
+            self.stats[STAT_ERROR_NUM_CONNECTIONS_LOST] += 1
+            raise
+        except Exception as err:
+            log.error(f"EXCEPTION: {err}")
+            sys.exit(99)
 
     async def homeassistant_discovery_message_publish(self, cfg: AppConfig):
         """
@@ -169,19 +268,21 @@ class OptoIsolatedInputsHandler:
         detect the binary_sensors associated with the GPIO inputs.
         See https://www.home-assistant.io/integrations/mqtt/#mqtt-discovery
         """
-        print(
+        log.info(
             f"Connecting to MQTT broker with identifier {OptoIsolatedInputsHandler.client_identifier_discovery_pub} to publish OPTOISOLATED INPUT discovery messages"
         )
-        self.stats["num_connections_discovery_publish"] += 1
+        self.stats[STAT_NUM_CONNECTIONS_DISCOVERY_PUBLISH] += 1
 
         try:
             async with cfg.create_aiomqtt_client(OptoIsolatedInputsHandler.client_identifier_discovery_pub) as client:
-                print("Publishing DISCOVERY messages for OPTOISOLATED INPUTs")
+                log.info("Publishing DISCOVERY messages for OPTOISOLATED INPUTs")
+                # these are the same for all entries:
+                mqtt_prefix = cfg.homeassistant_discovery_topic_prefix
+                mqtt_node_id = cfg.homeassistant_discovery_topic_node_id
+                device_dict = cfg.get_device_dict()
                 for entry in cfg.get_all_optoisolated_inputs():
-                    mqtt_prefix = cfg.homeassistant_discovery_topic_prefix
                     mqtt_platform = entry["home_assistant"]["platform"]
                     assert mqtt_platform == "binary_sensor"  # the only supported value for now
-                    mqtt_node_id = cfg.homeassistant_discovery_topic_node_id
                     mqtt_discovery_topic = f"{mqtt_prefix}/{mqtt_platform}/{mqtt_node_id}/{entry['name']}/config"
 
                     # NOTE: the HomeAssistant unique_id is what appears in the config file as "name"
@@ -193,28 +294,41 @@ class OptoIsolatedInputsHandler:
                         "payload_off": entry["mqtt"]["payload_off"],
                         "device_class": entry["home_assistant"]["device_class"],
                         "expire_after": entry["home_assistant"]["expire_after"],
-                        "device": cfg.get_device_dict(),
+                        "device": device_dict,
                     }
                     if entry["home_assistant"]["icon"] is not None:
                         # add icon to the config of the entry:
                         mqtt_payload_dict["icon"] = entry["home_assistant"]["icon"]
                     mqtt_payload = json.dumps(mqtt_payload_dict)
                     await client.publish(mqtt_discovery_topic, mqtt_payload, qos=MqttQOS.AT_LEAST_ONCE)
-                    self.stats["num_mqtt_discovery_messages_published"] += 1
+                    self.stats[STAT_NUM_MQTT_DISCOVERY_MESSAGES_PUBLISHED] += 1
         except aiomqtt.MqttError as err:
-            print(f"Connection lost: {err}; reconnecting in {cfg.mqtt_reconnection_period_sec} seconds ...")
-            self.stats["ERROR_num_connections_lost"] += 1
+            log.warning(f"Connection lost: {err}; reconnecting in {cfg.mqtt_reconnection_period_sec} seconds ...")
+            self.stats[STAT_ERROR_NUM_CONNECTIONS_LOST] += 1
             await asyncio.sleep(cfg.mqtt_reconnection_period_sec)
         except Exception as err:
-            print(f"EXCEPTION: {err}")
+            log.error(f"EXCEPTION: {err}")
             sys.exit(99)
 
-    def print_stats(self):
-        print(">> OPTO-ISOLATED INPUTS:")
-        print(f">>   Num (re)connections to the MQTT broker [publish channel]: {self.stats['num_connections_publish']}")
-        print(f">>   Num MQTT messages published to the broker: {self.stats['num_mqtt_messages']}")
-        print(f">>   Num actual readings of optoisolated inputs: {self.stats['num_readings']}")
-        print(">>   OPTO-ISOLATED DISCOVERY messages:")
-        print(f">>     Num MQTT discovery messages published: {self.stats['num_mqtt_discovery_messages_published']}")
-        print(f">>     Num (re)connections to the MQTT broker: {self.stats['num_connections_discovery_publish']}")
-        print(f">>   ERROR: MQTT connections lost: {self.stats['ERROR_num_connections_lost']}")
+    def print_stats(self, file=None):
+        print(">> OPTO-ISOLATED INPUTS:", file=file)
+        print(
+            f">>   Num (re)connections to the MQTT broker [publish channel]: {self.stats[STAT_NUM_CONNECTIONS_PUBLISH]}",
+            file=file,
+        )
+        print(f">>   Num MQTT messages published to the broker: {self.stats[STAT_NUM_MQTT_MESSAGES]}", file=file)
+        print(f">>   Num actual readings of optoisolated inputs: {self.stats[STAT_NUM_READINGS]}", file=file)
+        print(
+            f">>   Num readings of optoisolated inputs without any change: {self.stats[STAT_NUM_NOOP_READINGS]}",
+            file=file,
+        )
+        print(">>   OPTO-ISOLATED DISCOVERY messages:", file=file)
+        print(
+            f">>     Num MQTT discovery messages published: {self.stats[STAT_NUM_MQTT_DISCOVERY_MESSAGES_PUBLISHED]}",
+            file=file,
+        )
+        print(
+            f">>     Num (re)connections to the MQTT broker: {self.stats[STAT_NUM_CONNECTIONS_DISCOVERY_PUBLISH]}",
+            file=file,
+        )
+        print(f">>   ERROR: MQTT connections lost: {self.stats[STAT_ERROR_NUM_CONNECTIONS_LOST]}", file=file)
@@ -5,9 +5,9 @@
 # Created: Feb 2024
 # License: Apache license
 #
-# TODO: add HomeAssistant discovery messages
 
 import argparse
+import logging
 import os
 import fcntl
 import sys
@@ -15,6 +15,7 @@ import asyncio
 import gpiozero
 import subprocess
 import signal
+import aiomqtt
 from raspy2mqtt.stats import StatsCollector
 from raspy2mqtt.constants import SeqMicroHatConstants, MiscAppDefaults
 from raspy2mqtt.config import AppConfig
@@ -23,12 +24,27 @@ from raspy2mqtt.gpio_inputs_handler import GpioInputsHandler
 from raspy2mqtt.gpio_outputs_handler import GpioOutputsHandler
 from raspy2mqtt.homeassistant_status_tracker import HomeAssistantStatusTracker
 
+try:
+    # uvloop is an optional dependency: when available, it provides a faster (libuv-based) asyncio event loop
+    import uvloop
+except ImportError:
+    uvloop = None
+
 # =======================================================================================================
 # GLOBALs
 # =======================================================================================================
 
-# sets to True when the application was asked to exit:
-g_stop_requested = False
+log = logging.getLogger(__name__)
+
+# gets set when the application was asked to exit:
+g_stop_event = asyncio.Event()
+
+# the MQTT client identifier of the connection shared by the opto-isolated inputs, GPIO inputs and GPIO outputs coroutines
+g_mqtt_shared_client_identifier = "_shared"
+
+# file descriptor of the lock file acquired by instance_already_running(); it must stay open for the whole
+# lifetime of this process, since closing it releases the lock
+g_lock_file_descriptor = None
 
 
 # =======================================================================================================
@@ -47,7 +63,7 @@ def parse_command_line():
     parser.add_argument(
         "-c",
         "--config",
-        help=f"YAML file specifying the software configuration. Defaults to '{MiscAppDefaults.CONFIG_FILE}'",
+        help=f"YAML (or JSON, if the file has the .json extension) file specifying the software configuration. Defaults to '{MiscAppDefaults.CONFIG_FILE}'",
         default=MiscAppDefaults.CONFIG_FILE,
     )
     parser.add_argument(
@@ -57,6 +73,12 @@ def parse_command_line():
         action="store_true",
         default=False,
     )
+    parser.add_argument(
+        "--no-config-cache",
+        help=f"Always parse the YAML configuration file, ignoring the cached copy stored under '{MiscAppDefaults.CONFIG_CACHE_DIRECTORY}'",
+        action="store_true",
+        default=False,
+    )
     parser.add_argument("-v", "--verbose", help="Be verbose.", action="store_true", default=False)
     parser.add_argument(
         "-V",
@@ -83,32 +105,42 @@ def instance_already_running(label="default"):
     Detect if an an instance with the label is already running, globally
     at the operating system level.
 
-    Using `os.open` ensures that the file pointer won't be closed
-    by Python's garbage collector after the function's scope is exited.
+    The file descriptor of the lock file is stored in the g_lock_file_descriptor global
+    so that it is never closed (which would release the lock) until the program exits.
+    The file is opened with O_CLOEXEC so that its descriptor does not leak into
+    child processes (e.g. the one launched by shutdown()).
 
-    The lock will be released when the program exits, or could be
-    released if the file pointer were closed.
+    The lock is a whole-file flock(), released automatically when the program exits.
+    Once the lock is acquired, the PID of this process is written into the lock file.
     """
+    global g_lock_file_descriptor
 
     try:
-        lock_file_pointer = os.open(f"/tmp/instance_{label}.lock", os.O_WRONLY | os.O_CREAT)
-    except PermissionError as e:
-        print(f"Not enough permissions to write files under /tmp. Run this application as root: {e}")
+        g_lock_file_descriptor = os.open(
+            f"{MiscAppDefaults.LOCK_FILE_DIRECTORY}/{label}.lock", os.O_WRONLY | os.O_CREAT | os.O_CLOEXEC, 0o600
+        )
+    except OSError as e:
+        # e.g. not enough permissions (the app is not running as root) or a missing/read-only directory
+        print(f"Cannot create the lock file under {MiscAppDefaults.LOCK_FILE_DIRECTORY}: {e}")
         sys.exit(4)
 
     try:
         # LOCK_NB = lock non-blocking
         # LOCK_EX = exclusive lock
-        fcntl.lockf(lock_file_pointer, fcntl.LOCK_EX | fcntl.LOCK_NB)
-        already_running = False
-    except IOError:
-        already_running = True
+        fcntl.flock(g_lock_file_descriptor, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return True
 
-    return already_running
+    # for observability, store the PID of the instance holding the lock:
+    os.ftruncate(g_lock_file_descriptor, 0)
+    os.write(g_lock_file_descriptor, f"{os.getpid()}\n".encode())
+    return False
 
 
 def shutdown():
-    print("!! Detected long-press on the Sequent Microsystem button. Triggering clean shutdown of the Raspberry PI !!")
+    log.warning(
+        "!! Detected long-press on the Sequent Microsystem button. Triggering clean shutdown of the Raspberry PI !!"
+    )
     subprocess.call(["sudo", "shutdown", "-h", "now"])
 
 
@@ -120,20 +152,20 @@ def init_hardware(cfg: AppConfig):
     # assign the when_held function to be called when the button is held for more than 5 seconds
     # (NOTE: the way gpiozero works is that a new thread is spawned to listed for this event on the Raspy GPIO)
     if "GPIOZERO_PIN_FACTORY" in os.environ:
-        print(f"GPIO factory backend is: {os.environ['GPIOZERO_PIN_FACTORY']}")
+        log.info(f"GPIO factory backend is: {os.environ['GPIOZERO_PIN_FACTORY']}")
     else:
-        print(
+        log.info(
             "GPIO factory backend is the default one. This might fail on newer Raspbian versions with Linux kernel >= 6.6.20"
         )
 
     try:
         gpiozero.Device.ensure_pin_factory()
     except gpiozero.exc.BadPinFactory:
-        print("Unable to load a gpiozero pin factory. Typically this happens if you don't have pigpio installed.")
-        print("Alternatively you can run this software for basic testing exporting the env variable DISABLE_HW.")
+        log.error("Unable to load a gpiozero pin factory. Typically this happens if you don't have pigpio installed.")
+        log.error("Alternatively you can run this software for basic testing exporting the env variable DISABLE_HW.")
 
     buttons = []
-    print("Initializing SequentMicrosystem GPIO shutdown button")
+    log.info("Initializing SequentMicrosystem GPIO shutdown button")
     b = gpiozero.Button(SeqMicroHatConstants.SHUTDOWN_BUTTON_GPIO, hold_time=5)
     b.when_held = shutdown
     buttons.append(b)
@@ -146,31 +178,82 @@ def init_hardware(cfg: AppConfig):
 # =======================================================================================================
 
 
-async def signal_handler(sig: signal.Signals) -> None:
-    global g_stop_requested
-    g_stop_requested = True
-    print(f"Received signal {sig.name}... stopping all async tasks")
+def signal_handler(sig: signal.Signals) -> None:
+    """
+    Invoked by the event loop when a termination signal is received.
+    Setting the g_stop_event is a synchronous operation, so there's no need for a coroutine here.
+    """
+    g_stop_event.set()
+    log.info(f"Received signal {sig.name}... stopping all async tasks")
+
 
+async def publish_and_subscribe_over_shared_client(
+    cfg: AppConfig,
+    opto_inputs_handler: OptoIsolatedInputsHandler,
+    gpio_inputs_handler: GpioInputsHandler,
+    gpio_outputs_handler: GpioOutputsHandler,
+):
+    """
+    Runs all the coroutines handling opto-isolated inputs, GPIO inputs and outputs using a single connection
+    to the MQTT broker.
+    When such connection gets lost, all these coroutines are stopped and then restarted over a new connection.
+    """
+    while True:
+        log.info(
+            f"Connecting to MQTT broker with identifier {g_mqtt_shared_client_identifier} to publish OPTOISOLATED INPUT and GPIO INPUT states, subscribe to OUTPUT commands and publish OUTPUT states"
+        )
+        try:
+            # NOTE: the session is persistent so that output commands published by Home Assistant while
+            #       the connection is briefly down get queued by the broker and delivered after reconnecting;
+            #       the session expires after just MqttDefaults.SESSION_EXPIRY_INTERVAL_SEC seconds, so that
+            #       outputs (e.g. relays) are never driven by commands published a long time before
+            async with cfg.create_aiomqtt_client(g_mqtt_shared_client_identifier, persistent_session=True) as client:
+                async with asyncio.TaskGroup() as tg:
+                    tg.create_task(opto_inputs_handler.publish_optoisolated_inputs(cfg, client))
+                    tg.create_task(gpio_inputs_handler.process_gpio_inputs_queue_and_publish(cfg, client))
+                    tg.create_task(gpio_outputs_handler.subscribe_and_activate_outputs(cfg, client))
+                    tg.create_task(gpio_outputs_handler.publish_outputs_state(cfg, client))
+        except* aiomqtt.MqttError as err_group:
+            log.warning(
+                f"Connection lost: {err_group.exceptions[0]}; reconnecting in {cfg.mqtt_reconnection_period_sec} seconds ..."
+            )
+            await asyncio.sleep(cfg.mqtt_reconnection_period_sec)
 
-async def main_loop():
-    global g_stop_requested
 
+async def main_loop():
     cfg = AppConfig()
     print(f"{MiscAppDefaults.THIS_APP_NAME} version {cfg.app_version} starting")
 
     args = parse_command_line()
 
-    if not cfg.load(args.config):
+    # logging is configured before loading the config file, so that its messages are shown;
+    # per-event messages are logged at DEBUG level: they get formatted and printed only in verbose mode
+    # (NOTE: this is the same logic of AppConfig.merge_options_from_cli() and merge_options_from_env_vars())
+    verbose = args.verbose or os.environ.get("VERBOSE", None) is not None
+    logging.basicConfig(stream=sys.stdout, format="%(message)s", level=logging.DEBUG if verbose else logging.INFO)
+
+    cache_dir = None if args.no_config_cache else MiscAppDefaults.CONFIG_CACHE_DIRECTORY
+    if not cfg.load(args.config, cache_dir):
         return 1  # invalid config file... abort with failure exit code
 
     cfg.merge_options_from_cli(args)
     cfg.merge_options_from_env_vars()
     cfg.print_config_summary()
 
+    if cfg.cpu_affinity is not None:
+        # pin this process to a single CPU core to avoid scheduler migrations of the asyncio event loop thread;
+        # NOTE: this must happen before any gpiozero thread is spawned, so that those threads inherit the affinity
+        try:
+            os.sched_setaffinity(0, {cfg.cpu_affinity})
+        except OSError as e:
+            log.error(f"Failed to set the CPU affinity to core {cfg.cpu_affinity}: {e}")
+            return 1
+
     # install signal handler
     loop = asyncio.get_running_loop()
     for sig in [signal.SIGINT, signal.SIGTERM]:
-        loop.add_signal_handler(sig, lambda: asyncio.create_task(signal_handler(sig)))
+        # NOTE: pass 'sig' as argument of the callback to bind its current value
+        loop.add_signal_handler(sig, signal_handler, sig)
 
     # initialize handlers
     opto_inputs_handler = OptoIsolatedInputsHandler()
@@ -180,7 +263,10 @@ async def main_loop():
     stats_collector = StatsCollector([opto_inputs_handler, gpio_inputs_handler, gpio_outputs_handler])
 
     button_instances = init_hardware(cfg)
-    button_instances += opto_inputs_handler.init_hardware(cfg)
+    opto_inputs_buttons = opto_inputs_handler.init_hardware(cfg, loop)
+    if opto_inputs_buttons is None:
+        return 2  # the opto-isolated input board is missing or not responding... abort with failure exit code
+    button_instances += opto_inputs_buttons
     button_instances += gpio_inputs_handler.init_hardware(cfg, loop)
     gpio_outputs_handler.init_hardware(cfg)
 
@@ -193,65 +279,48 @@ async def main_loop():
 
     # wrap with error-handling code the main loop
     exit_code = 0
-    print("Starting main loop")
-    while not g_stop_requested:
-        # the double-nested 'try' is the only way I found in Python 3.11.2 to catch properly
-        # both exception groups (using the 'except*' syntax) and also have a default catch-all
-        # label using regular 'except' syntax.
-
-        # NOTE: unfortunately we cannot use a taskgroup: the problem is the function
-        # subscribe_and_activate_outputs() which uses the aiomqtt.Client.messages generator
-        # which does not allow to easily stop the 'waiting for next message' operation.
-        # This means we need to create each task manually with asyncio.EventLoop.create_task()
-        # and cancel() them whenever a SIGTERM is received.
-        #
-        # async with asyncio.TaskGroup() as tg:
-        #     tg.create_task(print_stats_periodically(cfg))
-        #     # inputs:
-        #     tg.create_task(publish_optoisolated_inputs(cfg))
-        #     tg.create_task(process_gpio_inputs_queue_and_publish(cfg))
-        #     # outputs:
-        #     tg.create_task(subscribe_and_activate_outputs(cfg))
-        #     tg.create_task(publish_outputs_state(cfg))
-
-        # launch all coroutines:
-        loop = asyncio.get_running_loop()
-        tasks = [
-            loop.create_task(stats_collector.print_stats_periodically(cfg)),
-            loop.create_task(opto_inputs_handler.publish_optoisolated_inputs(cfg)),
-            loop.create_task(gpio_inputs_handler.process_gpio_inputs_queue_and_publish(cfg)),
-            loop.create_task(gpio_outputs_handler.subscribe_and_activate_outputs(cfg)),
-            loop.create_task(gpio_outputs_handler.publish_outputs_state(cfg)),
-        ]
-
-        if cfg.homeassistant_discovery_messages_enable:
-            # subscribe to HomeAssistant status notification and eventually trigger MQTT discovery messages
-            loop.create_task(homeassistant_status_tracker.subscribe_status(cfg)),
-
-        # this main coroutine will simply wait till a SIGTERM arrives and
-        # we get g_stop_requested=True:
-        while not g_stop_requested:
-            await asyncio.sleep(1)
-
-        print("Main coroutine is now cancelling all sub-tasks (coroutines)")
-        GpioInputsHandler.stop_requested = True
-        GpioOutputsHandler.stop_requested = True
-        OptoIsolatedInputsHandler.stop_requested = True
-        for t in tasks:
-            t.cancel()
-
-        print("Waiting cancellation of all tasks")
-        for t in tasks:
-            # Wait for the task to be cancelled
-            try:
-                await t
-            except asyncio.CancelledError:
-                pass
-
-    print("Printing stats for the last time:")
+    log.info("Starting main loop")
+
+    # NOTE: each task is created manually (instead of using a TaskGroup) so that all of them can be
+    # cancel()ed whenever a SIGTERM is received: subscribe_and_activate_outputs() is blocked on the
+    # aiomqtt.Client.messages generator, which cannot be stopped in any other way.
+
+    # launch all coroutines:
+    tasks = [
+        loop.create_task(stats_collector.print_stats_periodically(cfg)),
+        loop.create_task(
+            publish_and_subscribe_over_shared_client(
+                cfg, opto_inputs_handler, gpio_inputs_handler, gpio_outputs_handler
+            )
+        ),
+    ]
+
+    if cfg.homeassistant_discovery_messages_enable:
+        # subscribe to HomeAssistant status notification and eventually trigger MQTT discovery messages
+        loop.create_task(homeassistant_status_tracker.subscribe_status(cfg)),
+
+    # this main coroutine will simply wait till a SIGTERM arrives and sets the g_stop_event:
+    await g_stop_event.wait()
+
+    log.info("Main coroutine is now cancelling all sub-tasks (coroutines)")
+    GpioInputsHandler.stop_requested = True
+    GpioOutputsHandler.stop_requested = True
+    OptoIsolatedInputsHandler.stop_requested = True
+    for t in tasks:
+        t.cancel()
+
+    log.info("Waiting cancellation of all tasks")
+    for t in tasks:
+        # Wait for the task to be cancelled
+        try:
+            await t
+        except asyncio.CancelledError:
+            pass
+
+    log.info("Printing stats for the last time:")
     stats_collector.print_stats()
 
-    print(f"Exiting gracefully with exit code {exit_code}...")
+    log.info(f"Exiting gracefully with exit code {exit_code}...")
     return exit_code
 
 
@@ -262,8 +331,15 @@ def main():
         )
         sys.exit(3)
 
+    loop_factory = None
+    if uvloop is not None:
+        print("Using uvloop as asyncio event loop")
+        loop_factory = uvloop.new_event_loop
+
     try:
-        sys.exit(asyncio.run(main_loop()))
+        # NOTE: passing the loop factory to the Runner avoids changing the global event loop policy
+        with asyncio.Runner(loop_factory=loop_factory) as runner:
+            sys.exit(runner.run(main_loop()))
     except KeyboardInterrupt:
         print("Stopping due to CTRL+C")
 
@@ -1,9 +1,10 @@
 #!/usr/bin/env python3
 
+import io
+import sys
 import time
 import asyncio
 
-# from raspy2mqtt.constants import *
 from raspy2mqtt.config import AppConfig
 
 #
@@ -30,21 +31,49 @@ class StatsCollector:
         self.start_time = time.time()
         self.counter = 1
         self.objs_with_stats = objs_with_stats
+        self.last_stats_snapshot = None
+
+    def take_stats_snapshot(self) -> tuple:
+        """
+        Returns an immutable copy of the stats counters of all the objects, to detect whether any of them
+        has changed since the previous snapshot.
+        The counters which increase periodically by design (listed in the 'periodic_stats' attribute of each object)
+        are excluded, otherwise they would make every snapshot differ from the previous one.
+        """
+        return tuple(
+            value for x in self.objs_with_stats for idx, value in enumerate(x.stats) if idx not in x.periodic_stats
+        )
 
     async def print_stats_periodically(self, cfg: AppConfig):
-        if cfg.stats_log_period_sec == 0:
+        stats_log_period_sec = cfg.stats_log_period_sec
+        if stats_log_period_sec == 0:
             return  # the user requested to NOT print periodically the stats
-        next_stat_time = time.time() + cfg.stats_log_period_sec
+        # the deadlines are computed from the event loop clock and advanced by exactly one period each time,
+        # so that the time spent printing the stats does not make the reports drift
+        loop = asyncio.get_running_loop()
+        next_stat_time = loop.time() + stats_log_period_sec
         while not StatsCollector.stop_requested:
-            # Print out stats to help debugging
-            if time.time() >= next_stat_time:
-                self.print_stats()
-                next_stat_time = time.time() + cfg.stats_log_period_sec
+            # sleep till the next stats report is due: no need to wake up in the meanwhile, since
+            # this task gets cancelled when the application is stopping
+            await asyncio.sleep(max(0, next_stat_time - loop.time()))
 
-            await asyncio.sleep(0.25)
+            # Print out stats to help debugging, skipping the report if nothing but the periodic counters
+            # has moved since the last one
+            stats_snapshot = self.take_stats_snapshot()
+            if stats_snapshot != self.last_stats_snapshot:
+                self.last_stats_snapshot = stats_snapshot
+                self.print_stats()
+            next_stat_time += stats_log_period_sec
 
     def print_stats(self):
-        print(f">> STAT REPORT #{self.counter}")
+        # collect the whole report in memory and write it to stdout at once, with a single write() syscall
+        report = io.StringIO()
+        self.print_stats_report(report)
+        sys.stdout.write(report.getvalue())
+        sys.stdout.flush()
+
+    def print_stats_report(self, file):
+        print(f">> STAT REPORT #{self.counter}", file=file)
 
         uptime_sec = time.time() - self.start_time
         m, s = divmod(uptime_sec, 60)
@@ -52,9 +81,9 @@ class StatsCollector:
         h = int(h)
         m = int(m)
         s = int(s)
-        print(f">> Uptime: {h}:{m:02}:{s:02}")
+        print(f">> Uptime: {h}:{m:02}:{s:02}", file=file)
 
         for x in self.objs_with_stats:
-            x.print_stats()
+            x.print_stats(file)
 
         self.counter += 1
@@ -1 +1,81 @@
 # pytest_plugins = ["docker_compose"]
+
+import pytest
+import asyncio
+from raspy2mqtt.config import AppConfig
+from raspy2mqtt.constants import MiscAppDefaults
+
+# GLOBALs
+
+# how long the unit tests wait for a condition before failing; this is not a delay: the waits
+# return as soon as the condition becomes true
+WAIT_TIMEOUT_SEC = 5.0
+
+# HELPERS
+
+
+async def wait_until(condition, timeout_sec: float = WAIT_TIMEOUT_SEC) -> None:
+    """
+    Polls the given callable until it returns true, yielding to the event loop in the meantime.
+    Raises TimeoutError if the condition does not become true within the given timeout.
+    """
+    async with asyncio.timeout(timeout_sec):
+        while not condition():
+            await asyncio.sleep(0.001)
+
+
+class FakeMqttClient:
+    """Records all the messages published through it"""
+
+    def __init__(self):
+        self.published = []
+
+    async def publish(self, topic, payload=None, qos=0, retain=False, properties=None):
+        self.published.append((topic, payload, qos, retain, properties))
+
+    def pop_published(self) -> list:
+        """Returns the (topic, payload, qos, retain) of the messages published so far and forgets them"""
+        published = self.published
+        self.published = []
+        return [(topic, payload, qos, retain) for topic, payload, qos, retain, _ in published]
+
+    async def wait_published(self, num_messages: int) -> list:
+        """Waits until at least 'num_messages' messages have been published, then behaves like pop_published()"""
+        await wait_until(lambda: len(self.published) >= num_messages)
+        return self.pop_published()
+
+
+@pytest.fixture(name="wait_until")
+def wait_until_fixture():
+    """
+    Fixture providing the wait_until() helper to the test modules
+    """
+    return wait_until
+
+
+@pytest.fixture
+def fake_mqtt_client():
+    """
+    Fixture providing a fake MQTT client which records the published messages
+    """
+    return FakeMqttClient()
+
+
+@pytest.fixture
+def load_test_config(tmpdir, monkeypatch):
+    """
+    Fixture providing a function that writes the given YAML into a config file, loads it and returns
+    the resulting AppConfig, with the HW access disabled
+    """
+    # with the HW disabled, the output channels write their state into this file:
+    monkeypatch.setattr(MiscAppDefaults, "INTEGRATION_TESTS_OUTPUT_FILE", str(tmpdir.join("outputs")))
+
+    def load(cfg_yaml: str) -> AppConfig:
+        p = tmpdir.join("testconfig.yaml")
+        p.write(cfg_yaml)
+        cfg = AppConfig()
+        assert cfg.load(str(p)) == True
+        cfg.disable_hw = True
+        return cfg
+
+    return load
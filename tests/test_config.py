@@ -36,6 +36,7 @@ def test_minimal_config_file_succeeds(tmpdir):
 
     assert x.mqtt_broker_host == "something"
     assert x.mqtt_broker_user is None
+    assert x.cpu_affinity is None
     assert x.get_optoisolated_input_config(1) is None
     assert len(x.get_all_gpio_inputs()) == 0
     assert len(x.get_all_outputs()) == 0
@@ -111,7 +112,7 @@ def test_config_file_using_defaults_succeeds(tmpdir):
         "active_low": False,
         "description": "radio_channel_a",
         "gpio": 27,
-        "mqtt": {"payload": "ARM_AWAY", "topic": "alarmo/command"},
+        "mqtt": {"payload": "ARM_AWAY", "topic": "alarmo/command", "debounce_msec": 0},
         "name": "radio_channel_a",
     }
 
@@ -146,6 +147,7 @@ home_assistant:
     enable: false
     topic_prefix: anotherprefix
     node_id: some_unique_device_id
+cpu_affinity: 3
 i2c_optoisolated_inputs:
   - name: opto_input_1
     description: just a test
@@ -168,6 +170,7 @@ gpio_inputs:
     mqtt:
       topic: test_topic_2
       payload: JUST_ONE_PAYLOAD_FOR_GPIO_INPUTS
+      debounce_msec: 50
 outputs:
   - name: a_button
     description: yet another test
@@ -208,6 +211,9 @@ def test_config_file_fully_specified_succeeds(tmpdir):
     assert x.homeassistant_discovery_topic_prefix == "anotherprefix"
     assert x.homeassistant_discovery_topic_node_id == "some_unique_device_id"
 
+    # MISC section
+    assert x.cpu_affinity == 3
+
     # OPTO-ISOLATED INPUTS
     # check that all attributes have been populated with the defaults:
     assert x.get_optoisolated_input_config(1) == {
@@ -231,7 +237,7 @@ def test_config_file_fully_specified_succeeds(tmpdir):
         "active_low": False,
         "description": "yet another test",
         "gpio": 27,
-        "mqtt": {"payload": "JUST_ONE_PAYLOAD_FOR_GPIO_INPUTS", "topic": "test_topic_2"},
+        "mqtt": {"payload": "JUST_ONE_PAYLOAD_FOR_GPIO_INPUTS", "topic": "test_topic_2", "debounce_msec": 50},
         "name": "radio_channel_a",
     }
 
@@ -327,3 +333,239 @@ def test_wrong_config_file_fails_3(tmpdir):
 
     x = AppConfig()
     assert x.load(str(p)) == False
+
+
+INVALID_OUTPUT_PLATFORM_CFG = """
+mqtt_broker:
+  host: something
+i2c_optoisolated_inputs:
+  - name: test
+    input_num: 16
+    active_low: false
+    home_assistant:
+      device_class: door
+outputs:
+  - name: test_output
+    gpio: 20
+    active_low: false
+    home_assistant:
+      platform: binary_sensor    # outputs can only be switches or buttons
+      device_class: switch
+"""
+
+
+@pytest.mark.unit
+def test_wrong_config_file_fails_4(tmpdir):
+    # create config file to test:
+    p = tmpdir.mkdir("cfg").join("testconfig.yaml")
+    p.write(INVALID_OUTPUT_PLATFORM_CFG)
+
+    x = AppConfig()
+    assert x.load(str(p)) == False
+
+    # the same output configured with a valid platform is accepted, together with input_num=16
+    p.write(INVALID_OUTPUT_PLATFORM_CFG.replace("platform: binary_sensor", "platform: switch"))
+    x = AppConfig()
+    assert x.load(str(p)) == True
+
+    # but input_num=17 is out of range
+    p.write(INVALID_OUTPUT_PLATFORM_CFG.replace("platform: binary_sensor", "platform: switch").replace("16", "17"))
+    x = AppConfig()
+    assert x.load(str(p)) == False
+
+
+DUPLICATED_NAME_CFG = """
+mqtt_broker:
+  host: something
+i2c_optoisolated_inputs:
+  - name: same_name
+    input_num: 1
+    active_low: false
+    home_assistant:
+      device_class: door
+outputs:
+  - name: same_name
+    gpio: 20
+    active_low: false
+    home_assistant:
+      device_class: switch
+"""
+
+
+@pytest.mark.unit
+def test_wrong_config_file_fails_5(tmpdir):
+    # create config file to test:
+    p = tmpdir.mkdir("cfg").join("testconfig.yaml")
+    p.write(DUPLICATED_NAME_CFG)
+
+    # names must be unique also across different sections:
+    x = AppConfig()
+    assert x.load(str(p)) == False
+
+    p.write(DUPLICATED_NAME_CFG.replace("- name: same_name\n    gpio", "- name: another_name\n    gpio"))
+    x = AppConfig()
+    assert x.load(str(p)) == True
+
+
+INVALID_DEBOUNCE_CFG = """
+mqtt_broker:
+  host: something
+gpio_inputs:
+  - name: test
+    gpio: 27
+    active_low: false
+    mqtt:
+      topic: alarmo/command
+      payload: ARM_AWAY
+      debounce_msec: -100    # negative intervals are not valid
+"""
+
+
+@pytest.mark.unit
+def test_wrong_config_file_fails_6(tmpdir):
+    # create config file to test:
+    p = tmpdir.mkdir("cfg").join("testconfig.yaml")
+    p.write(INVALID_DEBOUNCE_CFG)
+
+    x = AppConfig()
+    assert x.load(str(p)) == False
+
+    # a zero interval disables debouncing and is valid
+    p.write(INVALID_DEBOUNCE_CFG.replace("-100", "0"))
+    x = AppConfig()
+    assert x.load(str(p)) == True
+
+
+SHARED_SECTIONS_CFG = """
+mqtt_broker:
+  host: something
+i2c_optoisolated_inputs:
+  - name: opto_input_1
+    input_num: 1
+    active_low: false
+    mqtt: &shared_mqtt
+      payload_on: "1"
+    home_assistant: &shared_ha
+      device_class: door
+  - name: opto_input_2
+    input_num: 2
+    active_low: false
+    mqtt: *shared_mqtt
+    home_assistant: *shared_ha
+outputs:
+  - name: output_1
+    gpio: 20
+    active_low: false
+    mqtt: &shared_output_mqtt
+      payload_off: "0"
+    home_assistant: &shared_output_ha
+      device_class: switch
+  - name: output_2
+    gpio: 21
+    active_low: false
+    mqtt: *shared_output_mqtt
+    home_assistant: *shared_output_ha
+"""
+
+
+@pytest.mark.unit
+def test_config_file_with_shared_sections(tmpdir):
+    # create config file to test:
+    p = tmpdir.mkdir("cfg").join("testconfig.yaml")
+    p.write(SHARED_SECTIONS_CFG)
+
+    # YAML aliases make the entries share the same 'mqtt' and 'home_assistant' dicts;
+    # each entry must anyway get its own copy, populated with its own defaults:
+    x = AppConfig()
+    assert x.load(str(p), None) == True
+
+    for entries in [x.get_all_optoisolated_inputs(), x.get_all_outputs()]:
+        assert len(entries) == 2
+        first, second = entries
+        assert first["mqtt"] is not second["mqtt"]
+        assert first["home_assistant"] is not second["home_assistant"]
+        assert first["mqtt"]["topic"] == f"rpi2home-assistant/{first['name']}"
+        assert second["mqtt"]["topic"] == f"rpi2home-assistant/{second['name']}"
+
+    assert x.get_optoisolated_input_config(1)["mqtt"]["payload_on"] == "1"
+    assert x.get_optoisolated_input_config(2)["mqtt"]["payload_on"] == "1"
+    assert x.get_output_config_by_mqtt_topic("rpi2home-assistant/output_2")["mqtt"]["payload_off"] == "0"
+    assert (
+        x.get_output_config_by_mqtt_topic("rpi2home-assistant/output_2")["mqtt"]["state_topic"]
+        == "rpi2home-assistant/output_2/state"
+    )
+
+
+@pytest.mark.unit
+def test_config_file_cache(tmpdir):
+    # create config file to test:
+    p = tmpdir.mkdir("cfg").join("testconfig.yaml")
+    p.write(MINIMAL_CFG)
+    cache_dir = tmpdir.join("cache")
+    cache = cache_dir.join("testconfig.yaml.cache.json")
+
+    # the first load creates the cache file, readable only by its owner since it may contain credentials:
+    x = AppConfig()
+    assert x.load(str(p), str(cache_dir)) == True
+    assert cache.check()
+    assert cache.stat().mode & 0o777 == 0o600
+
+    # the second load uses the cache file, as long as the YAML file is unchanged:
+    cache.write(cache.read().replace("something", "cached_host"))
+    x = AppConfig()
+    assert x.load(str(p), str(cache_dir)) == True
+    assert x.mqtt_broker_host == "cached_host"
+
+    # the cache can be bypassed:
+    x = AppConfig()
+    assert x.load(str(p)) == True
+    assert x.mqtt_broker_host == "something"
+
+    # modifying the YAML file invalidates the cache:
+    p.write(MINIMAL_CFG.replace("something", "another_host"))
+    x = AppConfig()
+    assert x.load(str(p), str(cache_dir)) == True
+    assert x.mqtt_broker_host == "another_host"
+    assert [f.basename for f in cache_dir.listdir()] == ["testconfig.yaml.cache.json"]  # no leftover temporary file
+
+    # a cache written by another version of this app is ignored:
+    cache.write(cache.read().replace("another_host", "cached_host").replace(x.app_version, "0.0.0"))
+    x = AppConfig()
+    assert x.load(str(p), str(cache_dir)) == True
+    assert x.mqtt_broker_host == "another_host"
+
+
+@pytest.mark.unit
+def test_config_file_cache_not_written_for_invalid_config(tmpdir):
+    # create config file to test:
+    p = tmpdir.mkdir("cfg").join("testconfig.yaml")
+    p.write(DUPLICATED_NAME_CFG)
+    cache_dir = tmpdir.join("cache")
+
+    # the file is valid YAML but it fails validation: no cache must be written
+    x = AppConfig()
+    assert x.load(str(p), str(cache_dir)) == False
+    assert not cache_dir.join("testconfig.yaml.cache.json").check()
+
+    # failing to write the cache is not an error:
+    p.write(MINIMAL_CFG)
+    cache_dir.write("this is a regular file, not a directory")
+    x = AppConfig()
+    assert x.load(str(p), str(cache_dir)) == True
+    assert sorted(f.basename for f in tmpdir.listdir()) == ["cache", "cfg"]
+
+
+@pytest.mark.unit
+def test_json_config_file_succeeds(tmpdir):
+    # create config file to test:
+    p = tmpdir.mkdir("cfg").join("testconfig.json")
+    p.write('{"mqtt_broker": {"host": "something"}}')
+
+    x = AppConfig()
+    assert x.load(str(p), str(tmpdir.join("cache"))) == True
+    assert x.mqtt_broker_host == "something"
+    assert not tmpdir.join("cache").check()  # JSON files are never cached
+
+    p.write('{"mqtt_broker": ')
+    x = AppConfig()
+    assert x.load(str(p)) == False
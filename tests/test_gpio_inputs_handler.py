@@ -0,0 +1,78 @@
+import pytest
+import asyncio
+from raspy2mqtt.constants import MqttQOS
+from raspy2mqtt import gpio_inputs_handler
+from raspy2mqtt.gpio_inputs_handler import GpioInputsHandler
+
+GPIO_INPUTS_CFG = """
+mqtt_broker:
+  host: something
+gpio_inputs:
+  - name: debounced_input
+    gpio: 27
+    active_low: false
+    mqtt:
+      topic: alarmo/command
+      payload: ARM_AWAY
+      debounce_msec: 60000
+  - name: not_debounced_input
+    gpio: 22
+    active_low: false
+    mqtt:
+      topic: alarmo/command
+      payload: DISARM
+"""
+
+
+@pytest.mark.unit
+def test_gpio_inputs_debounce(load_test_config, fake_mqtt_client, wait_until):
+    cfg = load_test_config(GPIO_INPUTS_CFG)
+
+    arm_away = ("alarmo/command", b"ARM_AWAY", MqttQOS.AT_LEAST_ONCE, False)
+    disarm = ("alarmo/command", b"DISARM", MqttQOS.AT_LEAST_ONCE, False)
+
+    async def run_test():
+        # the debounce window is measured with the event loop clock: shift it forward to simulate
+        # the passing of time, instead of actually waiting
+        loop = asyncio.get_running_loop()
+        loop_time = loop.time
+        clock_shift_sec = [0.0]
+        loop.time = lambda: loop_time() + clock_shift_sec[0]
+
+        handler = GpioInputsHandler()
+        task = asyncio.create_task(handler.process_gpio_inputs_queue_and_publish(cfg, fake_mqtt_client))
+
+        def processed(num_notifications: int, num_messages: int) -> bool:
+            return (
+                handler.stats[gpio_inputs_handler.STAT_NUM_GPIO_NOTIFICATIONS] == num_notifications
+                and handler.stats[gpio_inputs_handler.STAT_NUM_MQTT_MESSAGES] == num_messages
+            )
+
+        # a burst of activations: the debounced GPIO publishes a single message, the other one publishes
+        # a message for each activation; activations of unconfigured GPIOs are ignored
+        for gpio_number in [27, 27, 22, 27, 22, 5]:
+            handler.gpio_queue.put_nowait(gpio_number)
+        await wait_until(lambda: processed(6, 3))
+        assert fake_mqtt_client.pop_published() == [arm_away, disarm, disarm]
+
+        # an activation inside the debounce window of the last published message is dropped:
+        clock_shift_sec[0] += 30.0
+        handler.gpio_queue.put_nowait(27)
+        handler.gpio_queue.put_nowait(22)
+        await wait_until(lambda: processed(8, 4))
+        assert fake_mqtt_client.pop_published() == [disarm]
+
+        # an activation outside the debounce window is published again:
+        clock_shift_sec[0] += 31.0
+        handler.gpio_queue.put_nowait(27)
+        await wait_until(lambda: processed(9, 5))
+        assert fake_mqtt_client.pop_published() == [arm_away]
+
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return handler
+
+    handler = asyncio.run(run_test())
+    assert handler.stats[gpio_inputs_handler.STAT_NUM_DEBOUNCED_NOTIFICATIONS] == 3
+    assert handler.stats[gpio_inputs_handler.STAT_ERROR_NOCONFIG] == 1
@@ -0,0 +1,99 @@
+import pytest
+import asyncio
+from raspy2mqtt.constants import MqttQOS, HomeAssistantDefaults
+from raspy2mqtt.gpio_outputs_handler import GpioOutputsHandler
+
+OUTPUTS_CFG = """
+mqtt_broker:
+  host: something
+home_assistant:
+  publish_period_msec: 100
+outputs:
+  - name: output_switch
+    gpio: 20
+    active_low: false
+    home_assistant:
+      device_class: switch
+  - name: output_button
+    gpio: 21
+    active_low: false
+    home_assistant:
+      platform: button
+      device_class: restart
+"""
+
+
+@pytest.mark.unit
+def test_output_status_transitions(load_test_config, wait_until, monkeypatch):
+    cfg = load_test_config(OUTPUTS_CFG)
+    monkeypatch.setattr(HomeAssistantDefaults, "BUTTON_MOMENTARY_PRESS_SEC", 0.1)
+
+    async def run_test():
+        handler = GpioOutputsHandler()
+        handler.init_hardware(cfg)
+        switch = handler.output_channels["rpi2home-assistant/output_switch"]
+        button = handler.output_channels["rpi2home-assistant/output_button"]
+        assert handler.output_status == 0b00
+
+        handler.turn_on(switch, 0b01)
+        assert handler.output_status == 0b01
+        assert switch.is_lit
+
+        # turning on an output already on does not change the bitmap:
+        handler.turn_on(switch, 0b01)
+        assert handler.output_status == 0b01
+
+        # the momentary press turns the button on and then automatically off again:
+        handler.press_button(button, 0b10)
+        assert handler.output_status == 0b11
+        assert button.is_lit
+        await wait_until(lambda: handler.output_status == 0b01)
+        assert not button.is_lit
+
+        handler.turn_off(switch, 0b01)
+        assert handler.output_status == 0b00
+        assert not switch.is_lit
+
+        # turning off an output already off does not change the bitmap:
+        handler.turn_off(switch, 0b01)
+        assert handler.output_status == 0b00
+
+    asyncio.run(run_test())
+
+
+@pytest.mark.unit
+def test_output_status_resynced_on_reconnection(load_test_config, fake_mqtt_client):
+    cfg = load_test_config(OUTPUTS_CFG)
+
+    switch_on = ("rpi2home-assistant/output_switch/state", b"ON", MqttQOS.AT_MOST_ONCE, True)
+    switch_off = ("rpi2home-assistant/output_switch/state", b"OFF", MqttQOS.AT_MOST_ONCE, True)
+    button_off = ("rpi2home-assistant/output_button/state", b"OFF", MqttQOS.AT_MOST_ONCE, True)
+
+    async def run_test():
+        handler = GpioOutputsHandler()
+        handler.init_hardware(cfg)
+        switch = handler.output_channels["rpi2home-assistant/output_switch"]
+
+        # first connection: the state of all outputs is published
+        task = asyncio.create_task(handler.publish_outputs_state(cfg, fake_mqtt_client))
+        assert await fake_mqtt_client.wait_published(2) == [switch_off, button_off]
+
+        # only the changed outputs get published again:
+        handler.turn_on(switch, 0b01)
+        assert await fake_mqtt_client.wait_published(1) == [switch_on]
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        # while disconnected, the bitmap drifts from the true state of the output channel:
+        handler.output_status = 0b10
+
+        # on the new connection the bitmap is re-synced from the output channels before publishing:
+        task = asyncio.create_task(handler.publish_outputs_state(cfg, fake_mqtt_client))
+        assert await fake_mqtt_client.wait_published(2) == [switch_on, button_off]
+        assert handler.output_status == 0b01
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run_test())
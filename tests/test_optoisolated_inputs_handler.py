@@ -0,0 +1,80 @@
+import pytest
+import asyncio
+from raspy2mqtt.constants import MqttQOS
+from raspy2mqtt.optoisolated_inputs_handler import OptoIsolatedInputsHandler
+
+OPTO_INPUTS_CFG = """
+mqtt_broker:
+  host: something
+home_assistant:
+  publish_period_msec: 1000
+i2c_optoisolated_inputs:
+  - name: opto_input_1
+    input_num: 1
+    active_low: false
+    home_assistant:
+      device_class: door
+  - name: opto_input_2
+    input_num: 2
+    active_low: true
+    home_assistant:
+      device_class: door
+      expire_after: 0
+"""
+
+
+@pytest.mark.unit
+def test_publish_changed_inputs_with_qos1_and_unchanged_ones_with_qos0(load_test_config, fake_mqtt_client):
+    cfg = load_test_config(OPTO_INPUTS_CFG)
+
+    async def run_test():
+        handler = OptoIsolatedInputsHandler()
+        assert handler.init_hardware(cfg, asyncio.get_running_loop()) == []
+        task = asyncio.create_task(handler.publish_optoisolated_inputs(cfg, fake_mqtt_client))
+
+        # first publish on a new connection: all inputs are considered as changed
+        assert await fake_mqtt_client.wait_published(2) == [
+            ("rpi2home-assistant/opto_input_1", b"OFF", MqttQOS.AT_LEAST_ONCE, True),
+            ("rpi2home-assistant/opto_input_2", b"ON", MqttQOS.AT_LEAST_ONCE, True),
+        ]
+
+        # a change of the 1st input is published immediately, without re-publishing the 2nd input:
+        handler.optoisolated_inputs_sampled_values = 0b01
+        handler.sampled_values_changed.set()
+        assert await fake_mqtt_client.wait_published(1) == [
+            ("rpi2home-assistant/opto_input_1", b"ON", MqttQOS.AT_LEAST_ONCE, True),
+        ]
+
+        # the next periodic publish re-publishes all the unchanged inputs with QoS 0:
+        assert await fake_mqtt_client.wait_published(2) == [
+            ("rpi2home-assistant/opto_input_1", b"ON", MqttQOS.AT_MOST_ONCE, True),
+            ("rpi2home-assistant/opto_input_2", b"ON", MqttQOS.AT_MOST_ONCE, True),
+        ]
+
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run_test())
+
+
+@pytest.mark.unit
+def test_retained_inputs_expire_only_if_expire_after_is_positive(load_test_config, fake_mqtt_client, wait_until):
+    cfg = load_test_config(OPTO_INPUTS_CFG)
+
+    async def run_test():
+        handler = OptoIsolatedInputsHandler()
+        handler.init_hardware(cfg, asyncio.get_running_loop())
+        task = asyncio.create_task(handler.publish_optoisolated_inputs(cfg, fake_mqtt_client))
+        await wait_until(lambda: len(fake_mqtt_client.published) >= 2)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run_test())
+
+    properties_by_topic = {topic: properties for topic, _, _, _, properties in fake_mqtt_client.published}
+    # the 1st input uses the default expire_after:
+    assert properties_by_topic["rpi2home-assistant/opto_input_1"].MessageExpiryInterval == 30
+    # the 2nd input has expire_after=0, so its retained state never expires:
+    assert properties_by_topic["rpi2home-assistant/opto_input_2"] is None